@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Dump and restore companies and quotes (the files of /api/admin/dump and /api/admin/restore)
+
+Usage: python backup.py dump backup.ndjson.gz [--format ndjson|csv] [--collection companies|quotes] [--tenant ID]
+       python backup.py restore backup.ndjson.gz [--format ndjson|csv] [--collection companies|quotes]
+"""
+
+import argparse
+import asyncio
+
+import server
+
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+async def read_chunks(path: str):
+    with open(path, "rb") as source:
+        while chunk := source.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+async def dump(args):
+    await server.connect_mongo()
+    collections = server.dump_collections(args.format, args.collection)
+    with open(args.path, "wb") as target:
+        async for chunk in server.dump_stream(args.format, collections, args.tenant):
+            target.write(chunk)
+    print(f"Wrote {', '.join(collections)} to {args.path}")
+
+
+async def restore(args):
+    await server.connect_mongo()
+    collections = server.dump_collections(args.format, args.collection)
+    counts = await server.restore_stream(read_chunks(args.path), args.format, collections[0])
+    print(f"Restored {counts['companies']} companies and {counts['quotes']} quotes ({counts['skipped']} already present)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("dump", "restore"))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=server.DUMP_FORMATS, default="ndjson")
+    parser.add_argument("--collection", choices=server.DUMP_COLLECTIONS)
+    parser.add_argument("--tenant", help="dump only this tenant's data")
+    args = parser.parse_args()
+
+    asyncio.run(dump(args) if args.command == "dump" else restore(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the backend hot paths (no database needed)
+
+Usage: python benchmark.py [--quotes 100] [--items 50] [--repeat 20] [--export-items 500] [--large-items 5000]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+from typing import List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+import bson
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import server
+
+
+def make_quote_document(number: int, items: int) -> dict:
+    """A quote shaped like what Mongo hands back to the read routes"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return {
+        "id": str(uuid.uuid4()),
+        "quote_number": str(number),
+        "customer": {
+            "name": "شركة الاختبار للمقاولات",
+            "tax_number": "123456789012345",
+            "street": "شارع الملك فهد",
+            "neighborhood": "حي العليا",
+            "country": "السعودية",
+            "city": "الرياض",
+            "commercial_registration": "1234567890",
+            "building": "123",
+            "postal_code": "12345",
+            "additional_number": "6789",
+            "phone": "+966 50 123 4567",
+        },
+        "project_description": "تركيب مظلات للمواقف في مجمع تجاري",
+        "location": "الرياض - حي العليا",
+        "items": [
+            {
+                "description": f"مظلة شد إنشائي 10x10 متر - بند {i}",
+                "quantity": 2,
+                "unit": "قطعة",
+                "unit_price": 15000.0,
+                "total_price": 30000.0,
+            }
+            for i in range(items)
+        ],
+        "subtotal": 30000.0 * items,
+        "tax_amount": 4500.0 * items,
+        "total_amount": 34500.0 * items,
+        "notes": "يشمل العرض الضمان لمدة سنتين",
+        "created_date": now,
+        "updated_date": now,
+        "version": 1,
+    }
+
+
+def timed(fn, repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name: str, samples: List[float], baseline: float = None):
+    median = statistics.median(samples)
+    line = f"{name:<40} median {median * 1000:9.2f} ms   min {min(samples) * 1000:9.2f} ms"
+    if baseline:
+        line += f"   x{baseline / median:.1f}"
+    print(line)
+    return median
+
+
+def bench_quote_list(quotes: int, items: int, repeat: int):
+    docs = [make_quote_document(n, items) for n in range(quotes)]
+    response_field = create_response_field(name="bench_quotes", type_=List[server.Quote])
+    loop = asyncio.new_event_loop()
+
+    def validated_path():
+        # What GET /api/quotes did before: Quote(**doc), then response_model validation and encoding
+        content = loop.run_until_complete(
+            serialize_response(field=response_field, response_content=[server.Quote(**dict(d)) for d in docs])
+        )
+        return JSONResponse(content).body
+
+    def fast_path():
+        return server.FastJSONResponse([server.quote_response_dict(dict(d)) for d in docs]).body
+
+    print(f"\nGET /api/quotes serialization ({quotes} quotes x {items} items)")
+    baseline = report("Quote(**doc) + response_model + json", timed(validated_path, repeat))
+    report("projection + orjson", timed(fast_path, repeat), baseline)
+    loop.close()
+
+
+def traced_peak(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_item_storage(items: int, repeat: int):
+    """Loading a large quote for export: item sub-documents vs columnar items, both
+    as insert_new_quote stores them (with tenant and render model)"""
+    quote_doc = server.quote_document(server.DEFAULT_TENANT_ID, server.Quote(**make_quote_document(1, items)))
+    plain = bson.encode(quote_doc)
+    packed = bson.encode(server.pack_large_items(dict(quote_doc)))
+
+    def load_plain():
+        return server.Quote(**bson.decode(plain))
+
+    def load_packed():
+        return server.quote_for_render(bson.decode(packed))
+
+    def respond_packed():
+        return server.FastJSONResponse(server.quote_response_dict(bson.decode(packed))).body
+
+    print(f"\nLarge quote storage ({items} items)")
+    print(f"{'BSON size':<40} items {len(plain) / 1024:9.1f} KiB   columnar {len(packed) / 1024:9.1f} KiB")
+    baseline = report("decode + Quote(**doc)", timed(load_plain, repeat))
+    report("decode + columnar quote_for_render", timed(load_packed, repeat), baseline)
+    report("decode + columnar API response", timed(respond_packed, repeat))
+    print(f"{'peak memory while loading':<40} items {traced_peak(load_plain) / 1024 / 1024:7.2f} MiB"
+          f"   columnar {traced_peak(load_packed) / 1024 / 1024:7.2f} MiB")
+
+
+def bench_export_memory(items: int):
+    """Peak traced memory, top allocation sites and output size per renderer"""
+    quote = server.Quote(**make_quote_document(1, items))
+    company = server.CompanyInfo()
+
+    print(f"\nExport rendering memory ({items} items)")
+    for export_format, renderer in server.EXPORT_RENDERERS.items():
+        server.render_memory.measure(export_format, renderer, quote, company)
+        record = server.render_memory.recent[-1]
+        print(
+            f"{export_format:<8} peak {record['peak_bytes'] / 1024 / 1024:8.2f} MiB"
+            f"   output {record['output_bytes'] / 1024:8.1f} KiB   {record['duration_ms']:8.1f} ms"
+        )
+        for site in record["top_sites"][:3]:
+            print(f"           {site['size_bytes'] / 1024:10.1f} KiB  {site['site']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quotes", type=int, default=100)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--export-items", type=int, default=500)
+    parser.add_argument("--large-items", type=int, default=5000)
+    args = parser.parse_args()
+
+    bench_quote_list(args.quotes, args.items, args.repeat)
+    bench_item_storage(args.large_items, args.repeat)
+    bench_export_memory(args.export_items)
+
+
+if __name__ == "__main__":
+    main()
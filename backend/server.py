@@ -1,18 +1,38 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form, Request, Query, Depends
+from fastapi.responses import FileResponse, StreamingResponse, Response, JSONResponse, ORJSONResponse
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, DeleteOne, ReturnDocument, ReadPreference, monitoring
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError, PyMongoError
+from bson import Binary
 import os
 import logging
+import logging.handlers
+import queue
+import atexit
+import contextvars
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime, timezone
-import shutil
+import re
+import hashlib
+import hmac
+import heapq
+import tempfile
+import textwrap
+import unicodedata
+import mimetypes
+from datetime import datetime, timezone, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlencode
 from openpyxl import Workbook
-from io import BytesIO
+from io import BytesIO, StringIO
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm
@@ -23,23 +43,250 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_RIGHT, TA_CENTER
 import json
+import csv
+import codecs
+import copy
+import array
+import asyncio
+import time
+import collections
+import collections.abc
+import functools
+import math
+import random
+import sys
+import threading
+import tracemalloc
+from contextlib import asynccontextmanager
+import orjson
+import zlib
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:  # PDFs fall back to unshaped text in the base fonts
+    arabic_reshaper = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # thumbnails are unavailable without it
+    pdfium = None
+
+try:
+    import brotli
+except ImportError:  # responses fall back to zstd or gzip
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Per-request context: the request id for log lines and the time the request
+# spent in Mongo and in export renders, reported on its access-log line
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+class DatabaseTimer(monitoring.CommandListener):
+    """Adds each command's server round trip to the current request's DB time.
+    Motor runs commands on its executor with a copy of the caller's context, so
+    the request's timings dict is reachable from here. Recent durations are also
+    kept process-wide for the health endpoint."""
+
+    def __init__(self, keep: int = 1000):
+        self.recent = collections.deque(maxlen=keep)
+        self.failures = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self.failures += 1
+        self._record(event)
+
+    def _record(self, event):
+        duration_ms = event.duration_micros / 1000
+        self.recent.append(duration_ms)
+        timings = request_timings.get()
+        if timings is not None:
+            timings["db_ms"] += duration_ms
+            timings["db_ops"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        durations = sorted(self.recent)
+        if not durations:
+            return {"samples": 0, "failures": self.failures}
+        def percentile(p):
+            return round(durations[min(len(durations) - 1, int(len(durations) * p))], 2)
+        return {"samples": len(durations), "failures": self.failures, "p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "max_ms": durations[-1]}
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool counters; events arrive from pymongo's threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count("pool_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count("closed")
+
+    def connection_check_out_started(self, event):
+        self._count("check_out_started")
+
+    def connection_check_out_failed(self, event):
+        self._count("check_out_failed")
+
+    def connection_checked_out(self, event):
+        self._count("checked_out")
+
+    def connection_checked_in(self, event):
+        self._count("checked_in")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            counts = dict(self.counts)
+        get = lambda name: counts.get(name, 0)
+        return {
+            "open": get("created") - get("closed"),
+            "in_use": get("checked_out") - get("checked_in"),
+            "waiting": get("check_out_started") - get("checked_out") - get("check_out_failed"),
+            "created": get("created"),
+            "check_out_failed": get("check_out_failed"),
+            "pool_cleared": get("pool_cleared"),
+        }
+
+# MongoDB connection: one client per process, created at startup (connect_mongo)
+# after the server answers a ping. Pool limits keep a rolling restart from opening
+# hundreds of connections at once; list and export reads may go to secondaries.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_NAME = os.environ['DB_NAME']
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")  # for list and export reads
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 100)),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+    # Connections a pool establishes concurrently; the rest wait instead of piling onto the server
+    "maxConnecting": int(os.environ.get("MONGO_MAX_CONNECTING", 2)),
+    "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 5 * 60 * 1000)),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+    "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)),
+    "appname": os.environ.get("MONGO_APP_NAME", "quotes-backend"),
+    # Dates come back as aware UTC datetimes, so routes that go through the
+    # models serialize them with an offset just like the orjson fast path
+    "tz_aware": True,
+}
+MONGO_STARTUP_RETRIES = int(os.environ.get("MONGO_STARTUP_RETRIES", 5))
+MONGO_STARTUP_RETRY_DELAY = float(os.environ.get("MONGO_STARTUP_RETRY_DELAY", 1))
+MONGO_PING_TIMEOUT = float(os.environ.get("MONGO_PING_TIMEOUT", 2))
+
+database_timer = DatabaseTimer()
+pool_monitor = PoolMonitor()
+client = None
+db = None
+read_db = None  # db with MONGO_READ_PREFERENCE
+
+async def connect_mongo():
+    """Creates the client (unless one was set up already) and waits until MongoDB answers,
+    retrying with jittered exponential backoff so restarted workers do not reconnect in lockstep"""
+    global client, db, read_db
+    if MONGO_READ_PREFERENCE not in READ_PREFERENCES:
+        raise RuntimeError(f"MONGO_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCES)}")
+    if client is None:
+        client = AsyncIOMotorClient(mongo_url, event_listeners=[database_timer, pool_monitor], **MONGO_CLIENT_OPTIONS)
+        db = client[DB_NAME]
+        read_db = client.get_database(DB_NAME, read_preference=READ_PREFERENCES[MONGO_READ_PREFERENCE])
+    for attempt in range(1, MONGO_STARTUP_RETRIES + 1):
+        try:
+            await db.command("ping")
+            return
+        except PyMongoError as exc:
+            if attempt == MONGO_STARTUP_RETRIES:
+                raise
+            delay = MONGO_STARTUP_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning("MongoDB is not reachable (attempt %d of %d), retrying in %.1fs: %s", attempt, MONGO_STARTUP_RETRIES, delay, exc)
+            await asyncio.sleep(delay)
+
+class FastJSONResponse(ORJSONResponse):
+    """orjson rendering; naive datetimes coming back from Mongo are emitted as UTC"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Process lifecycle in order: the Mongo client comes first and is closed last,
+    also when startup fails. The steps are defined at the end of the module."""
+    try:
+        await connect_mongo()
+        await create_indexes()
+        # Before serving, so no quote is left outside a tenant
+        await migrate_to_tenants()
+        start_background_jobs()
+        yield
+        await stop_background_jobs()
+    finally:
+        if client is not None:
+            client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # تحديد مجلد المشروع
 ROOT_DIR = Path(__file__).parent
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Uploaded files are named logo_<sha256><ext>, so a given name always maps to the same bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024
+SAFE_FILENAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,254}$")
+CONTENT_HASH_FILENAME_RE = re.compile(r"^logo_([0-9a-f]{64})(\.[a-z0-9]+)?$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Logo uploads larger than this are rejected while they stream in
+MAX_LOGO_SIZE = int(os.environ.get("MAX_LOGO_SIZE", 5 * 1024 * 1024))
+# Allowance for multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+# Every Nth quote revision (1, N + 1, 2N + 1, ...) stores a full snapshot, the rest store
+# diffs against the previous version; 1 makes every revision a snapshot
+QUOTE_SNAPSHOT_INTERVAL = max(1, int(os.environ.get("QUOTE_SNAPSHOT_INTERVAL", 10)))
+
 # إنشاء الراوتر مع بادئة /api
 api_router = APIRouter(prefix="/api")
 
@@ -98,6 +345,7 @@ class QuoteItem(BaseModel):
     unit: str
     unit_price: float
     total_price: float
+    catalog_item_id: Optional[str] = None  # the catalog entry the line was picked from
 
 class QuoteCreate(BaseModel):
     customer: CustomerInfo
@@ -122,6 +370,9 @@ class Quote(BaseModel):
     notes: Optional[str] = None
     created_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    version: int = 1
+    # Stored render model, see render_model()
+    _render_model: Optional[Dict[str, Any]] = PrivateAttr(default=None)
 
 class QuoteUpdate(BaseModel):
     customer: Optional[CustomerInfo] = None
@@ -133,18 +384,1213 @@ class QuoteUpdate(BaseModel):
     total_amount: Optional[float] = None
     notes: Optional[str] = None
 
+class QuoteRevision(BaseModel):
+    version: int
+    kind: str  # "snapshot" or "diff"
+    created_date: datetime
+    changed_fields: List[str] = []
+
+class CatalogItemCreate(BaseModel):
+    code: Optional[str] = None
+    description: str
+    unit: str
+    unit_price: float
+
+class CatalogItem(CatalogItemCreate):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    created_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Fast path for read routes: let Mongo project the response shape and send the
+# documents straight to orjson instead of building Quote objects that FastAPI
+# would then validate and serialize a second time against response_model
+QUOTE_PROJECTION = {"_id": 0, **{field: 1 for field in Quote.model_fields}, "items_packed": 1}
+QUOTE_DEFAULTS = {
+    name: field.default
+    for name, field in Quote.model_fields.items()
+    if not field.is_required() and field.default_factory is None
+}
+
+def quote_response_dict(quote: Dict[str, Any]) -> Dict[str, Any]:
+    """Trusted DB document -> response body, filling defaults for fields older documents lack"""
+    unpack_items(quote)
+    for name, default in QUOTE_DEFAULTS.items():
+        if name not in quote:
+            quote[name] = default
+    return quote
+
+# Columnar item storage for large quotes: rather than one BSON sub-document per
+# item, the item fields are stored as parallel columns (numbers as packed
+# little-endian doubles, units dictionary-encoded) under items_packed. The API
+# still sends plain item lists; exporters get items materialized on access.
+COLUMNAR_ITEMS_THRESHOLD = int(os.environ.get("COLUMNAR_ITEMS_THRESHOLD", 200))  # 0 disables
+PACKED_ITEMS_FORMAT = 1
+PACKED_NUMBER_COLUMNS = ("quantity", "unit_price", "total_price")
+
+def _pack_array(typecode: str, values) -> Binary:
+    column = array.array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return Binary(column.tobytes())
+
+def _unpack_array(typecode: str, data: bytes) -> array.array:
+    column = array.array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+def pack_items(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    units = list(dict.fromkeys(item["unit"] for item in items))
+    unit_numbers = {unit: number for number, unit in enumerate(units)}
+    packed = {
+        "format": PACKED_ITEMS_FORMAT,
+        "description": [item["description"] for item in items],
+        "units": units,
+        "unit_index": _pack_array("I", (unit_numbers[item["unit"]] for item in items)),
+    }
+    for name in PACKED_NUMBER_COLUMNS:
+        packed[name] = _pack_array("d", (item[name] for item in items))
+    if any(item.get("catalog_item_id") for item in items):
+        packed["catalog_item_id"] = [item.get("catalog_item_id") for item in items]
+    return packed
+
+def pack_large_items(quote: Dict[str, Any]) -> Dict[str, Any]:
+    """Switch a quote document (in place) to columnar items when it has enough of them"""
+    if COLUMNAR_ITEMS_THRESHOLD and len(quote.get("items") or ()) >= COLUMNAR_ITEMS_THRESHOLD:
+        quote["items_packed"] = pack_items(quote.pop("items"))
+    return quote
+
+def unpack_items(quote: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn columnar items back into the plain item list (in place)"""
+    if "items_packed" in quote:
+        quote["items"] = PackedItems(quote.pop("items_packed")).dicts()
+    return quote
+
+class PackedItems(collections.abc.Sequence):
+    """Read-only view of columnar items; QuoteItem objects are built only when accessed"""
+
+    def __init__(self, packed: Dict[str, Any]):
+        units = packed["units"]
+        self.description = packed["description"]
+        self.unit = [units[number] for number in _unpack_array("I", packed["unit_index"])]
+        self.quantity, self.unit_price, self.total_price = (
+            _unpack_array("d", packed[name]) for name in PACKED_NUMBER_COLUMNS
+        )
+        self.catalog_item_id = packed.get("catalog_item_id") or [None] * len(self.description)
+
+    def __len__(self) -> int:
+        return len(self.description)
+
+    def _item(self, index: int) -> QuoteItem:
+        return QuoteItem.model_construct(
+            description=self.description[index],
+            quantity=self.quantity[index],
+            unit=self.unit[index],
+            unit_price=self.unit_price[index],
+            total_price=self.total_price[index],
+            catalog_item_id=self.catalog_item_id[index],
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self)))]
+        return self._item(range(len(self))[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._item(index)
+
+    def dicts(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "description": description, "quantity": quantity, "unit": unit, "unit_price": unit_price,
+                "total_price": total_price, "catalog_item_id": catalog_item_id,
+            }
+            for description, quantity, unit, unit_price, total_price, catalog_item_id
+            in zip(self.description, self.quantity, self.unit, self.unit_price, self.total_price, self.catalog_item_id)
+        ]
+
+# Tenants: each trading entity has its own company document and quote numbering,
+# and every quote carries the tenant it belongs to. Requests pick the tenant with
+# the X-Tenant-ID header; without it they act on the default tenant, which also
+# holds the data from before tenants existed.
+DEFAULT_TENANT_ID = os.environ.get("DEFAULT_TENANT_ID", "default")
+TENANT_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+COMPANY_CACHE_TTL = float(os.environ.get("COMPANY_CACHE_TTL", 30))
+
+def current_tenant(request: Request) -> str:
+    tenant_id = request.headers.get("x-tenant-id") or DEFAULT_TENANT_ID
+    if not TENANT_ID_RE.match(tenant_id):
+        raise HTTPException(status_code=400, detail="Invalid X-Tenant-ID")
+    return tenant_id
+
+class CompanyCache:
+    """Company info per tenant, so exports and ETag checks do not read it on every request.
+    Writes through this worker take effect at once; other workers see them within the TTL."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.entries: Dict[str, Tuple[float, CompanyInfo, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, tenant_id: str) -> Tuple[CompanyInfo, str]:
+        """The tenant's company info and its validator timestamp"""
+        entry = self.entries.get(tenant_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        company = await db.companies.find_one({"tenant_id": tenant_id}, {"_id": 0, "tenant_id": 0})
+        if not company:
+            # First use of the tenant: create its default company info
+            company = CompanyInfo().dict()
+            await db.companies.update_one({"tenant_id": tenant_id}, {"$setOnInsert": company}, upsert=True)
+        loaded_at = time.monotonic()
+        company_info, version = CompanyInfo(**company), validator_timestamp(company.get("updated_date"))
+        self.entries[tenant_id] = (loaded_at, company_info, version)
+        return company_info, version
+
+    def invalidate(self, tenant_id: str):
+        self.entries.pop(tenant_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"tenants": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+company_cache = CompanyCache(COMPANY_CACHE_TTL)
+
+async def migrate_to_tenants():
+    """Moves single-company data to the default tenant"""
+    legacy_company = await db.company.find_one({}, {"_id": 0})
+    if legacy_company:
+        await db.companies.update_one({"tenant_id": DEFAULT_TENANT_ID}, {"$setOnInsert": legacy_company}, upsert=True)
+    result = await db.quotes.update_many({"tenant_id": {"$exists": False}}, {"$set": {"tenant_id": DEFAULT_TENANT_ID}})
+    if result.modified_count:
+        logger.info("Assigned %d quotes to tenant %s", result.modified_count, DEFAULT_TENANT_ID)
+
 # Utility functions
-async def get_next_quote_number():
-    """Generate next sequential quote number"""
-    last_quote = await db.quotes.find_one(sort=[("created_date", -1)])
-    if last_quote:
+async def last_quote_number(tenant_id: str) -> int:
+    """The tenant's highest quote number; archived quotes count too, as archival can
+    move every quote out of db.quotes before the counter is first seeded"""
+    query = {"tenant_id": tenant_id}
+    last = 0
+    for collection in (db.quotes, db.archived_quotes):
+        last_quote = await collection.find_one(query, {"quote_number": 1}, sort=[("created_date", -1)])
+        if not last_quote:
+            continue
+        try:
+            last = max(last, int(last_quote.get("quote_number", "0")))
+        except (TypeError, ValueError):
+            return await db.quotes.count_documents(query) + await db.archived_quotes.count_documents(query)
+    return last
+
+async def seed_quote_counter(tenant_id: str):
+    """Moves the tenant's counter up to its latest quote ($max keeps racing seeds harmless)"""
+    await db.counters.update_one({"_id": f"quote_number:{tenant_id}"}, {"$max": {"seq": await last_quote_number(tenant_id)}}, upsert=True)
+
+async def get_next_quote_number(tenant_id: str) -> str:
+    """Next sequential quote number of the tenant, from an atomic per-tenant counter"""
+    counter_id = f"quote_number:{tenant_id}"
+    counter = await db.counters.find_one_and_update({"_id": counter_id}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER)
+    if counter is None:
+        # No counter yet: continue after the tenant's latest quote
+        await seed_quote_counter(tenant_id)
+        counter = await db.counters.find_one_and_update({"_id": counter_id}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER)
+    return str(counter["seq"])
+
+def resolve_upload_path(filename: str) -> Path:
+    """Map a requested filename onto UPLOAD_DIR, rejecting anything that could escape it"""
+    if not SAFE_FILENAME_RE.match(filename) or ".." in filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    upload_root = UPLOAD_DIR.resolve()
+    file_path = (upload_root / filename).resolve()
+    if file_path.parent != upload_root:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    return file_path
+
+def upload_etag(filename: str, stat_result: os.stat_result) -> str:
+    """Strong ETag: the content hash for content-addressed files, mtime/size otherwise"""
+    match = CONTENT_HASH_FILENAME_RE.match(filename)
+    if match:
+        return f'"{match.group(1)}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+def matching_etag(if_none_match: str, etag: str) -> Optional[str]:
+    """The If-None-Match entry matching our ETag (weak comparison, as RFC 9110 requires), as the client sent it"""
+    if if_none_match.strip() == "*":
+        return etag
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return next((tag for tag in candidates if tag.removeprefix("W/") == etag), None)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    return matching_etag(if_none_match, etag) is not None
+
+def not_modified_since(if_modified_since: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return int(mtime) <= since.timestamp()
+
+def parse_byte_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None when the header should be ignored (unknown unit, multiple ranges,
+    malformed syntax) and raises 416 when the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_str, sep, end_str = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_str == "":
+            # Suffix range: the last N bytes
+            suffix_length = int(end_str)
+            if suffix_length <= 0:
+                raise ValueError
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+    except ValueError:
+        return None
+    if start > end and end_str:
+        return None
+    if start >= file_size or file_size == 0:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, min(end, file_size - 1)
+
+def iter_file_range(file_path: Path, start: int, end: int):
+    """Yield the inclusive byte range [start, end] of a file in chunks"""
+    remaining = end - start + 1
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+]
+
+def sniff_image_extension(head: bytes) -> Optional[str]:
+    """Detect the image type from magic bytes instead of trusting the client's content_type"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+class ThreadedFileSink:
+    """Binary file writer whose blocking open/write/close run in the threadpool"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+
+    async def __aenter__(self):
+        self._file = await run_in_threadpool(open, self.path, "wb")
+        return self
+
+    async def write(self, data: bytes):
+        await run_in_threadpool(self._file.write, data)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await run_in_threadpool(self._file.close)
+
+def commit_upload(tmp_path: Path, file_path: Path):
+    """Move a finished upload into place unless identical content is already stored"""
+    if not file_path.exists():
+        os.replace(tmp_path, file_path)
+
+class UploadSizeLimitMiddleware:
+    """Abort oversized request bodies on upload routes while they are still streaming in.
+
+    Multipart parsing spools the whole body before the endpoint runs, so the
+    limit has to be applied at the ASGI receive level to stop large uploads early.
+    """
+
+    def __init__(self, app, max_body_size: int, paths: List[str]):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Quote revision history
+def revision_payload(quote: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a quote document that is versioned, always with a plain item list"""
+    return unpack_items({k: v for k, v in quote.items() if k not in ("_id", "tenant_id", "version", "render_model")})
+
+def _join_path(path: str, key) -> str:
+    return f"{path}.{key}" if path else str(key)
+
+def _diff_into(old, new, path: str, diff: Dict[str, list]):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                diff["unset"].append(_join_path(path, key))
+        for key, value in new.items():
+            if key in old:
+                _diff_into(old[key], value, _join_path(path, key), diff)
+            else:
+                diff["set"].append([_join_path(path, key), value])
+    elif isinstance(old, list) and isinstance(new, list):
+        if len(old) != len(new):
+            diff["len"].append([path, len(new)])
+        for i, value in enumerate(new):
+            if i < len(old):
+                _diff_into(old[i], value, _join_path(path, i), diff)
+            else:
+                diff["set"].append([_join_path(path, i), value])
+    elif type(old) is not type(new) or old != new:
+        diff["set"].append([path, new])
+
+def diff_documents(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, list]:
+    """Compact forward diff from `old` to `new` that records only the changed leaves.
+
+    Paths are dotted (list indexes included) and kept as [path, value] pairs so
+    they can be stored in Mongo without dotted field names.
+    """
+    diff = {"set": [], "unset": [], "len": []}
+    _diff_into(old, new, "", diff)
+    return diff
+
+def _resolve_parent(doc, path: str):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        target = target[int(part)] if isinstance(target, list) else target[part]
+    last = parts[-1]
+    return target, int(last) if isinstance(target, list) else last
+
+def apply_diff(doc: Dict[str, Any], diff: Dict[str, list]) -> Dict[str, Any]:
+    """Apply a diff produced by diff_documents in place"""
+    for path, length in diff.get("len", []):
+        parent, key = _resolve_parent(doc, path)
+        target = parent[key]
+        del target[length:]
+        target.extend([None] * (length - len(target)))
+    for path, value in diff.get("set", []):
+        parent, key = _resolve_parent(doc, path)
+        parent[key] = copy.deepcopy(value)
+    for path in diff.get("unset", []):
+        parent, key = _resolve_parent(doc, path)
+        parent.pop(key, None)
+    return doc
+
+def changed_fields(diff: Dict[str, list]) -> List[str]:
+    paths = [path for path, _ in diff["set"]] + diff["unset"] + [path for path, _ in diff["len"]]
+    return sorted({path.split(".")[0] for path in paths})
+
+async def record_quote_revision(previous: Optional[Dict[str, Any]], current: Dict[str, Any]):
+    """Append the revision record for `current`; `previous` is None for the first version"""
+    version = current["version"]
+    revision = {
+        "quote_id": current["id"],
+        "version": version,
+        "created_date": datetime.now(timezone.utc),
+        "changed_fields": [],
+    }
+    diff = None
+    if previous is not None:
+        diff = diff_documents(revision_payload(previous), revision_payload(current))
+        revision["changed_fields"] = changed_fields(diff)
+    if diff is None or (version - 1) % QUOTE_SNAPSHOT_INTERVAL == 0:
+        revision["kind"] = "snapshot"
+        revision["snapshot"] = revision_payload(current)
+    else:
+        revision["kind"] = "diff"
+        revision["diff"] = diff
+    # Upsert so a racing first edit of a pre-history quote cannot duplicate version 1
+    await db.quote_revisions.update_one(
+        {"quote_id": revision["quote_id"], "version": version},
+        {"$setOnInsert": revision},
+        upsert=True
+    )
+
+async def load_quote_version(quote_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Rebuild a historical version from the nearest snapshot plus the diffs after it"""
+    base = await db.quote_revisions.find_one(
+        {"quote_id": quote_id, "kind": "snapshot", "version": {"$lte": version}},
+        sort=[("version", -1)]
+    )
+    if not base:
+        return None
+    diffs = await db.quote_revisions.find(
+        {"quote_id": quote_id, "version": {"$gt": base["version"], "$lte": version}},
+        {"diff": 1, "version": 1}
+    ).sort("version", 1).to_list(None)
+    if base["version"] + len(diffs) != version:
+        return None
+    quote = base["snapshot"]
+    for revision in diffs:
+        apply_diff(quote, revision["diff"])
+    quote["version"] = version
+    return quote
+
+# Date storage: older documents carry ISO strings, which sort as text and cannot
+# use a date index for range queries. Convert them to BSON datetimes in place.
+DATE_FIELDS = ("created_date", "updated_date")
+DATE_MIGRATION_BATCH_SIZE = 500
+
+def parse_stored_date(value: Any) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+async def migrate_string_dates(collection, batch_size: int = DATE_MIGRATION_BATCH_SIZE) -> int:
+    """Rewrite string date fields as datetimes, one _id-ordered batch at a time"""
+    query = {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
+    projection = {field: 1 for field in DATE_FIELDS}
+    converted = 0
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else {**query, "_id": {"$gt": last_id}}
+        docs = await collection.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        operations = []
+        for doc in docs:
+            updates = {}
+            for field in DATE_FIELDS:
+                parsed = parse_stored_date(doc.get(field))
+                if parsed is not None:
+                    updates[field] = parsed
+            if updates:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": updates}))
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+    return converted
+
+async def run_date_migration():
+    try:
+        for collection in (db.quotes, db.companies):
+            converted = await migrate_string_dates(collection)
+            if converted:
+                logger.info("Converted string dates to datetimes in %d %s documents", converted, collection.name)
+    except Exception:
+        logger.exception("Date migration failed")
+
+def created_range_query(date_from: Optional[datetime], date_to: Optional[datetime]) -> Dict[str, Any]:
+    query = {}
+    if date_from or date_to:
+        # Range on created_date is served by the created_date index
+        query["created_date"] = {}
+        if date_from:
+            query["created_date"]["$gte"] = as_utc(date_from)
+        if date_to:
+            query["created_date"]["$lte"] = as_utc(date_to)
+    return query
+
+def as_utc(value: datetime) -> datetime:
+    """Query parameters without an offset are taken as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+# Conditional GET for quotes: validators come from updated_date plus the version
+# counter, so a revalidation only needs a projected read of those two fields
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+QUOTE_VALIDATOR_PROJECTION = {"_id": 0, "updated_date": 1, "version": 1}
+
+def validator_timestamp(value: Any) -> str:
+    """Millisecond UTC timestamp, the precision Mongo stores datetimes at"""
+    if isinstance(value, str):
+        value = parse_stored_date(value)
+    if not isinstance(value, datetime):
+        return "0"
+    value = as_utc(value)
+    return f"{int(value.replace(microsecond=0).timestamp())}{value.microsecond // 1000:03d}"
+
+def quote_etag(quote: Dict[str, Any], variant: Optional[str] = None) -> str:
+    etag = f"{quote.get('version') or 1}-{validator_timestamp(quote.get('updated_date'))}"
+    if variant:
+        etag += f"-{variant}"
+    return f'"{etag}"'
+
+async def quote_not_modified(request: Request, tenant_id: str, quote_id: str, variant: Optional[str] = None) -> Optional[Response]:
+    """Answer If-None-Match with a 304 without loading the full quote document"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    stamp = await find_quote(tenant_id, quote_id, QUOTE_VALIDATOR_PROJECTION)
+    if not stamp:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    # A compressed 200 carried the weak form of the ETag (CompressionMiddleware), so the
+    # 304 repeats the tag as the client holds it for caches to match it to their copy
+    matched = matching_etag(if_none_match, quote_etag(stamp, variant))
+    if matched:
+        return Response(status_code=304, headers={"ETag": matched, "Cache-Control": CONDITIONAL_CACHE_CONTROL})
+    return None
+
+# Live quote change feed (server-sent events). One watcher per worker follows the
+# quotes collection and fans lightweight events out to every connected client.
+QUOTE_EVENT_FIELDS = ("id", "tenant_id", "quote_number", "version", "updated_date")
+QUOTE_EVENT_PROJECTION = {"_id": 1, **{field: 1 for field in QUOTE_EVENT_FIELDS}}
+QUOTE_EVENTS_BUFFER_SIZE = 1000
+QUOTE_EVENTS_QUEUE_SIZE = 100
+QUOTE_EVENTS_POLL_INTERVAL = float(os.environ.get("QUOTE_EVENTS_POLL_INTERVAL", 2))
+SSE_HEARTBEAT_INTERVAL = 15
+CHANGE_STREAMS_UNSUPPORTED = 40573  # standalone mongod
+CHANGE_STREAM_HISTORY_LOST = 286
+
+class QuoteEventBroker:
+    """Shares a single change stream (or, on a standalone mongod, a single poller) between all SSE clients.
+
+    Event ids are change-stream resume tokens, so a client reconnecting to any
+    worker can resume; recent events are also kept in memory for cheap replays.
+    """
+
+    def __init__(self):
+        self.subscribers: Dict[asyncio.Queue, str] = {}  # queue -> tenant id
+        self.recent = collections.deque(maxlen=QUOTE_EVENTS_BUFFER_SIZE)
+        self.mode = None  # "change_stream" or "polling"
+        self._task = None
+        self._resume_token = None
+        self._known_ids = collections.OrderedDict()
+        self._stopped = False
+
+    def subscribe(self, tenant_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUOTE_EVENTS_QUEUE_SIZE)
+        if self._stopped:
+            # Shutting down: the stream ends at once and the client reconnects elsewhere
+            queue.put_nowait(None)
+            return queue
+        self.subscribers[queue] = tenant_id
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.pop(queue, None)
+        if not self.subscribers and self._task is not None:
+            # Nobody is listening: stop watching. The next subscriber starts afresh, and
+            # clients reconnecting with an older event id are replayed from Mongo.
+            self._task.cancel()
+            self._task = None
+            self._resume_token = None
+
+    def _end_stream(self, queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def start(self):
+        self._stopped = False
+
+    async def stop(self):
+        """Ends every open stream and the watcher; called on shutdown"""
+        self._stopped = True
+        for queue in list(self.subscribers):
+            self._end_stream(queue)
+        self.subscribers.clear()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, token: str, event: Dict[str, Any]):
+        self.recent.append((token, event))
+        for queue, tenant_id in list(self.subscribers.items()):
+            if not event_visible(event, tenant_id):
+                continue
+            try:
+                queue.put_nowait((token, event))
+            except asyncio.QueueFull:
+                # Slow client: end its stream, it reconnects and resumes from its last event id
+                self.subscribers.pop(queue, None)
+                self._end_stream(queue)
+
+    def note_deleted(self, quote_id: str, tenant_id: str):
+        """Polling cannot see deletes, so the delete route reports them to local clients"""
+        if self.mode == "polling":
+            event = {"type": "delete", "id": quote_id, "tenant_id": tenant_id}
+            self.publish(f"p{validator_timestamp(datetime.now(timezone.utc))}-{quote_id}", event)
+
+    def _pipeline(self):
+        return [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+            # Real quote edits always set updated_date; skip background render model refreshes
+            {"$match": {"$or": [
+                {"operationType": {"$ne": "update"}},
+                {"updateDescription.updatedFields.updated_date": {"$exists": True}},
+            ]}},
+            {"$project": {"operationType": 1, "documentKey": 1, **{f"fullDocument.{f}": 1 for f in QUOTE_EVENT_FIELDS}}},
+        ]
+
+    def _change_event(self, change: Dict[str, Any]) -> Dict[str, Any]:
+        operation = change["operationType"]
+        document_key = str(change["documentKey"]["_id"])
+        if operation == "delete":
+            # The deleted document is gone; we can name it only if we saw it earlier
+            quote_id, tenant_id = self._known_ids.pop(document_key, (None, None))
+            return {"type": "delete", "id": quote_id, "tenant_id": tenant_id}
+        quote = change.get("fullDocument") or {}
+        if quote.get("id"):
+            self._known_ids[document_key] = (quote["id"], quote.get("tenant_id"))
+            self._known_ids.move_to_end(document_key)
+            if len(self._known_ids) > 10 * QUOTE_EVENTS_BUFFER_SIZE:
+                self._known_ids.popitem(last=False)
+        return {"type": "insert" if operation == "insert" else "update", **{f: quote.get(f) for f in QUOTE_EVENT_FIELDS}}
+
+    async def _run(self):
+        while True:
+            try:
+                if self.mode == "polling":
+                    await self._poll()
+                else:
+                    await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as exc:
+                if exc.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.info("Change streams unavailable, polling for quote events every %ss", QUOTE_EVENTS_POLL_INTERVAL)
+                    self.mode = "polling"
+                    continue
+                if exc.code == CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None
+                    self.publish(f"reset-{uuid.uuid4().hex}", {"type": "reset"})
+                logger.warning("Quote change stream failed, restarting: %s", exc)
+                await asyncio.sleep(1)
+            except Exception:
+                logger.exception("Quote event watcher failed, restarting")
+                await asyncio.sleep(1)
+
+    async def _watch(self):
+        async with db.quotes.watch(self._pipeline(), full_document="updateLookup", resume_after=self._resume_token) as stream:
+            self.mode = "change_stream"
+            async for change in stream:
+                self._resume_token = change["_id"]
+                self.publish(change["_id"]["_data"], self._change_event(change))
+
+    async def _poll(self):
+        since = datetime.now(timezone.utc)
+        # Writes can land in the millisecond last read, so that millisecond is read again
+        # and the quote versions already published from it are skipped
+        seen_at_since = set()
+        while True:
+            quotes = await db.quotes.find(
+                {"updated_date": {"$gte": since}}, QUOTE_EVENT_PROJECTION
+            ).sort("updated_date", 1).to_list(500)
+            for quote in quotes:
+                seen = (quote["id"], quote.get("version"))
+                if quote["updated_date"] != since:
+                    since = quote["updated_date"]
+                    seen_at_since = set()
+                elif seen in seen_at_since:
+                    continue
+                seen_at_since.add(seen)
+                event = {"type": "insert" if quote.get("version", 1) == 1 else "update", **{f: quote.get(f) for f in QUOTE_EVENT_FIELDS}}
+                self.publish(f"p{validator_timestamp(since)}-{quote['id']}", event)
+            await asyncio.sleep(QUOTE_EVENTS_POLL_INTERVAL)
+
+    async def replay(self, last_event_id: str) -> Optional[list]:
+        """Events after `last_event_id`, or None if they can no longer be recovered"""
+        for index, (token, _) in enumerate(self.recent):
+            if token == last_event_id:
+                return list(self.recent)[index + 1:]
+        if self.mode != "change_stream" or last_event_id.startswith(("p", "reset")):
+            return None
+        # Not in this worker's buffer (e.g. reconnected to another worker): replay from Mongo
+        events = []
+        try:
+            async with db.quotes.watch(self._pipeline(), full_document="updateLookup", resume_after={"_data": last_event_id}) as stream:
+                while (change := await stream.try_next()) is not None:
+                    events.append((change["_id"]["_data"], self._change_event(change)))
+        except OperationFailure:
+            return None
+        return events
+
+quote_events = QuoteEventBroker()
+
+def event_visible(event: Dict[str, Any], tenant_id: str) -> bool:
+    # Resets, and deletes of quotes this worker never saw, carry no tenant and go to everyone
+    return event.get("tenant_id") in (None, tenant_id)
+
+def format_sse(token: str, event: Dict[str, Any]) -> str:
+    data = orjson.dumps(event, option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z).decode()
+    return f"id: {token}\ndata: {data}\n\n"
+
+async def quote_event_stream(tenant_id: str, last_event_id: Optional[str]):
+    queue = quote_events.subscribe(tenant_id)
+    try:
+        yield "retry: 3000\n\n"
+        last_token = None
+        if last_event_id:
+            missed = await quote_events.replay(last_event_id)
+            if missed is None:
+                # Too far behind to replay: the client should reload its list
+                yield format_sse(f"reset-{uuid.uuid4().hex}", {"type": "reset"})
+            else:
+                for token, event in missed:
+                    if event_visible(event, tenant_id):
+                        yield format_sse(token, event)
+                    last_token = token
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                break
+            token, event = item
+            if last_token is not None:
+                # Skip live events already delivered by the replay
+                if token <= last_token:
+                    continue
+                last_token = None
+            yield format_sse(token, event)
+    finally:
+        quote_events.unsubscribe(queue)
+
+# Idempotency keys: a retried request carrying the same Idempotency-Key gets the
+# stored response of the first attempt instead of running again
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_WAIT_TIMEOUT = 30
+# The running attempt renews its lease; a record whose lease ran out belongs to a
+# worker that died mid-request, and the next retry takes the key over
+IDEMPOTENCY_LEASE = float(os.environ.get("IDEMPOTENCY_LEASE", 60))
+IDEMPOTENCY_SKIPPED_HEADERS = {"content-length", "etag"}
+# Response bodies up to this size are kept in the record. Larger ones (exports) are
+# kept on local disk by content hash and the record references the file; a retry
+# that finds the file gone (evicted, or written by another host) runs for real.
+IDEMPOTENCY_INLINE_BODY = 64 * 1024
+IDEMPOTENCY_ARTIFACT_DIR = ROOT_DIR / "idempotency"
+IDEMPOTENCY_ARTIFACT_BYTES = int(os.environ.get("IDEMPOTENCY_ARTIFACT_BYTES", 256 * 1024 * 1024))
+
+class FileCache:
+    """Content-addressed files in one directory, evicting the least recently used
+    past max_bytes. Each worker only evicts files it has seen, so the budget is
+    approximate when several workers share the directory."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: collections.OrderedDict[str, int] = collections.OrderedDict()  # oldest first
+        self.total_bytes = 0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = [(path.stat(), path.name) for path in self.directory.iterdir() if path.is_file() and not path.name.startswith(".")]
+        for stat_result, name in sorted(files, key=lambda item: item[0].st_mtime):
+            self.entries[name] = stat_result.st_size
+            self.total_bytes += stat_result.st_size
+        self.loaded = True
+
+    def _touch(self, name: str, size: int):
+        self.total_bytes += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+
+    def _forget(self, name: str):
+        self.total_bytes -= self.entries.pop(name, 0)
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            if not self.loaded:
+                self._load()
+        try:
+            data = (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            with self.lock:
+                self._forget(name)
+            return None
+        with self.lock:
+            self._touch(name, len(data))
+        return data
+
+    def path(self, name: str) -> Optional[Path]:
+        """The file's path while it is cached, for streaming it instead of reading it whole"""
+        with self.lock:
+            if not self.loaded:
+                self._load()
+        path = self.directory / name
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            with self.lock:
+                self._forget(name)
+            return None
+        with self.lock:
+            self._touch(name, size)
+        return path
+
+    def temp_path(self) -> Path:
+        """A fresh path in the cache directory that the cache itself ignores"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory / f".{uuid.uuid4().hex}.tmp"
+
+    def put(self, name: str, data: bytes):
+        with self.lock:
+            if not self.loaded:
+                self._load()
+        tmp_path = self.directory / f".{name}.{uuid.uuid4().hex}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.directory / name)
+        self._added(name, len(data))
+
+    def put_file(self, name: str, source: Path) -> bool:
+        """Adds a finished file from temp_path() as a hard link, leaving `source` to the
+        caller; False if it is too large to keep"""
+        with self.lock:
+            if not self.loaded:
+                self._load()
+        size = source.stat().st_size
+        if size > self.max_bytes:
+            return False
+        tmp_path = self.directory / f".{name}.{uuid.uuid4().hex}.tmp"
+        os.link(source, tmp_path)
+        os.replace(tmp_path, self.directory / name)
+        self._added(name, size)
+        return True
+
+    def _added(self, name: str, size: int):
+        with self.lock:
+            self._touch(name, size)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                oldest, _ = next(iter(self.entries.items()))
+                self._forget(oldest)
+                (self.directory / oldest).unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"files": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+idempotency_artifacts = FileCache(IDEMPOTENCY_ARTIFACT_DIR, IDEMPOTENCY_ARTIFACT_BYTES)
+
+# Requests currently executing in this worker, so concurrent duplicates can await them
+_idempotency_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+async def capture_response(response: Response) -> Tuple[Dict[str, Any], Optional[Path]]:
+    """The storable form of a response. Streamed and large bodies are spooled to a
+    temporary file, returned alongside, and stored by their sha256 instead."""
+    headers = {k: v for k, v in response.headers.items() if k not in IDEMPOTENCY_SKIPPED_HEADERS}
+    stored = {"status_code": response.status_code, "headers": headers}
+    streamed = isinstance(response, StreamingResponse)
+    if not streamed and len(response.body) <= IDEMPOTENCY_INLINE_BODY:
+        stored["body"] = response.body
+        return stored, None
+    async def body_chunks():
+        if streamed:
+            async for chunk in response.body_iterator:
+                yield chunk.encode() if isinstance(chunk, str) else chunk
+        else:
+            yield response.body
+
+    spool_path = await run_in_threadpool(idempotency_artifacts.temp_path)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        async with ThreadedFileSink(spool_path) as sink:
+            async for chunk in body_chunks():
+                hasher.update(chunk)
+                size += len(chunk)
+                await sink.write(chunk)
+    except BaseException:
+        await run_in_threadpool(spool_path.unlink, True)
+        raise
+    stored["artifact"] = hasher.hexdigest()
+    stored["size"] = size
+    return stored, spool_path
+
+def stored_response(stored: Dict[str, Any], replayed: bool, body_path: Optional[Path] = None, spooled: bool = False) -> Response:
+    """A stored response; a referenced body streams from `body_path`, which is deleted afterwards if `spooled`"""
+    headers = dict(stored["headers"])
+    if replayed:
+        headers["idempotent-replayed"] = "true"
+    if "artifact" not in stored:
+        return Response(content=bytes(stored["body"]), status_code=stored["status_code"], headers=headers)
+    headers["content-length"] = str(stored["size"])
+    return StreamingResponse(
+        iter_file_range(body_path, 0, stored["size"] - 1),
+        status_code=stored["status_code"],
+        headers=headers,
+        background=BackgroundTask(body_path.unlink, True) if spooled else None,
+    )
+
+async def replay_stored(stored: Dict[str, Any]) -> Optional[Response]:
+    """The stored response of a completed request, or None if its body file is gone"""
+    if "artifact" not in stored:
+        return stored_response(stored, replayed=True)
+    body_path = await run_in_threadpool(idempotency_artifacts.path, stored["artifact"])
+    if body_path is None:
+        return None
+    return stored_response(stored, replayed=True, body_path=body_path)
+
+def idempotency_lease() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LEASE)
+
+def idempotency_lease_expired(record: Dict[str, Any]) -> bool:
+    # Records written before leases existed expire a lease after their creation
+    lease_until = record.get("lease_until") or record["created_date"] + timedelta(seconds=IDEMPOTENCY_LEASE)
+    return as_utc(lease_until) < datetime.now(timezone.utc)
+
+async def renew_idempotency_lease(record_id: Dict[str, str]):
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LEASE / 3)
+        await db.idempotency_keys.update_one({**record_id, "status": "in_progress"}, {"$set": {"lease_until": idempotency_lease()}})
+
+async def replay_idempotent(record_id: Dict[str, str], request_hash: str) -> Optional[Response]:
+    """Serve a duplicate request from the stored response, waiting while the original is still running.
+    None means this request has taken the key over: the original's lease expired, or
+    its stored body file is gone."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        record = await db.idempotency_keys.find_one(record_id)
+        if record is None:
+            raise HTTPException(status_code=409, detail="Original request failed, retry it", headers={"Retry-After": "1"})
+        if record["request_hash"] != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if record["status"] == "completed":
+            replayed = await replay_stored(record["response"])
+            if replayed is not None:
+                return replayed
+            # The body file is gone: take the key over and run the request again
+            taken = await db.idempotency_keys.find_one_and_update(
+                {**record_id, "status": "completed", "response.artifact": record["response"]["artifact"]},
+                {
+                    "$set": {"status": "in_progress", "lease_until": idempotency_lease(), "created_date": datetime.now(timezone.utc)},
+                    "$unset": {"response": ""},
+                },
+            )
+            if taken is not None:
+                return None
+            continue
+        if idempotency_lease_expired(record):
+            # Matching the lease we saw lets only one of several retries win the takeover
+            taken = await db.idempotency_keys.find_one_and_update(
+                {**record_id, "status": "in_progress", "lease_until": record.get("lease_until")},
+                {"$set": {"lease_until": idempotency_lease(), "created_date": datetime.now(timezone.utc)}},
+            )
+            if taken is not None:
+                return None
+            continue
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress", headers={"Retry-After": "1"})
+        inflight = _idempotency_inflight.get((record_id["scope"], record_id["key"]))
+        if inflight is not None:
+            # Original runs in this worker: wait for it instead of polling
+            await asyncio.wait([inflight], timeout=remaining)
+        else:
+            await asyncio.sleep(0.1)
+
+async def run_idempotent(request: Request, scope: str, handler) -> Response:
+    key = request.headers.get("idempotency-key")
+    if not key:
+        return await handler()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+    body = await request.body()
+    request_hash = hashlib.sha256(f"{request.url.path}?{request.url.query}\n".encode() + body).hexdigest()
+    record_id = {"scope": scope, "key": key}
+    try:
+        await db.idempotency_keys.insert_one({
+            **record_id,
+            "request_hash": request_hash,
+            "status": "in_progress",
+            "created_date": datetime.now(timezone.utc),
+            "lease_until": idempotency_lease(),
+        })
+    except DuplicateKeyError:
+        replayed = await replay_idempotent(record_id, request_hash)
+        if replayed is not None:
+            return replayed
+
+    inflight = asyncio.get_running_loop().create_future()
+    _idempotency_inflight[(scope, key)] = inflight
+    lease_renewal = asyncio.create_task(renew_idempotency_lease(record_id))
+    try:
+        response = await handler()
+        stored, spool_path = await capture_response(response)
+        kept = spool_path is None or await run_in_threadpool(idempotency_artifacts.put_file, stored["artifact"], spool_path)
+        if 200 <= stored["status_code"] < 300 and kept:
+            await db.idempotency_keys.update_one(record_id, {"$set": {"status": "completed", "response": stored}})
+        else:
+            # Only successful responses are replayed; anything else may be retried for real
+            await db.idempotency_keys.delete_one(record_id)
+        return stored_response(stored, replayed=False, body_path=spool_path, spooled=True)
+    except BaseException:
+        await db.idempotency_keys.delete_one(record_id)
+        raise
+    finally:
+        lease_renewal.cancel()
+        inflight.set_result(None)
+        _idempotency_inflight.pop((scope, key), None)
+
+def idempotent(scope: str):
+    """Route decorator honouring the Idempotency-Key header; the endpoint must take `request: Request`"""
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            # Keys are per tenant, like everything they guard
+            tenant_scope = f"{scope}:{current_tenant(kwargs['request'])}"
+            return await run_idempotent(kwargs["request"], tenant_scope, lambda: endpoint(*args, **kwargs))
+        return wrapper
+    return decorator
+
+# Cold storage: quotes not updated for ARCHIVE_AFTER_DAYS move in batches to
+# archived_quotes with their items zlib-compressed and no render model, which
+# keeps the hot collection and its indexes small. Lookups by id fall back to
+# the archive; editing an archived quote moves it back first.
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 730))  # 0 disables the background job
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", 24 * 3600))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_COMPRESSION_LEVEL = 9
+ARCHIVE_ONLY_FIELDS = ("items_compressed", "archived_date")
+
+def freeze_quote(quote: Dict[str, Any]) -> Dict[str, Any]:
+    """Hot quote document -> archive document (keeps _id, so re-archiving is a duplicate key)"""
+    archived = {k: v for k, v in unpack_items(quote).items() if k not in ("items", "render_model")}
+    archived["items_compressed"] = Binary(zlib.compress(orjson.dumps(quote.get("items", [])), ARCHIVE_COMPRESSION_LEVEL))
+    archived["archived_date"] = datetime.now(timezone.utc)
+    return archived
+
+def thaw_quote(archived: Dict[str, Any]) -> Dict[str, Any]:
+    quote = {k: v for k, v in archived.items() if k not in ARCHIVE_ONLY_FIELDS}
+    if "items_compressed" in archived:
+        quote["items"] = orjson.loads(zlib.decompress(archived["items_compressed"]))
+    return quote
+
+def archive_projection(projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The archive-side equivalent of a quotes projection"""
+    if projection is None:
+        return {"_id": 0}
+    archived = {k: v for k, v in projection.items() if k not in ("items", "items_packed", "render_model")}
+    if projection.get("items"):
+        archived["items_compressed"] = 1
+    return archived
+
+async def find_quote(tenant_id: str, quote_id: str, projection: Optional[Dict[str, Any]] = None, database=None) -> Optional[Dict[str, Any]]:
+    """A quote by id from the hot collection, or else from the archive"""
+    database = database if database is not None else db
+    query = {"tenant_id": tenant_id, "id": quote_id}
+    quote = await database.quotes.find_one(query, projection)
+    if quote is None:
+        archived = await database.archived_quotes.find_one(query, archive_projection(projection))
+        if archived is not None:
+            quote = thaw_quote(archived)
+    return quote
+
+async def merge_by_created_date(*sources, newest_first: bool = False):
+    """Merge quote streams that are each sorted by created_date into one sorted stream"""
+    sign = -1 if newest_first else 1
+    def key(quote):
+        return sign * int(validator_timestamp(quote.get("created_date")))
+    heads = []
+    for index, source in enumerate(sources):
+        quote = await anext(source, None)
+        if quote is not None:
+            heads.append((key(quote), index, quote))
+    heapq.heapify(heads)
+    while heads:
+        _, index, quote = heads[0]
+        yield quote
+        quote = await anext(sources[index], None)
+        if quote is None:
+            heapq.heappop(heads)
+        else:
+            heapq.heapreplace(heads, (key(quote), index, quote))
+
+def only_duplicate_keys(exc: BulkWriteError) -> bool:
+    return all(error["code"] == 11000 for error in exc.details["writeErrors"])
+
+async def archive_quotes(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Moves quotes last updated before `cutoff` to the archive; safe to run from several workers at once"""
+    archived = 0
+    while True:
+        batch = await db.quotes.find({"updated_date": {"$lt": cutoff}}).sort("updated_date", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return archived
+        try:
+            await db.archived_quotes.insert_many([freeze_quote(quote) for quote in batch], ordered=False)
+        except BulkWriteError as exc:
+            # Duplicates are copies left by an interrupted or concurrent run
+            if not only_duplicate_keys(exc):
+                raise
+        # Guarded on version: a quote edited meanwhile stays hot
+        result = await db.quotes.bulk_write(
+            [DeleteOne({"_id": quote["_id"], "version": quote.get("version")}) for quote in batch], ordered=False
+        )
+        if result.deleted_count < len(batch):
+            kept = await db.quotes.find({"_id": {"$in": [quote["_id"] for quote in batch]}}, {"_id": 1}).to_list(None)
+            await db.archived_quotes.delete_many({"_id": {"$in": [quote["_id"] for quote in kept]}})
+        archived += result.deleted_count
+
+async def run_archival():
+    while True:
         try:
-            last_number = int(last_quote.get("quote_number", "0"))
-            return str(last_number + 1)
-        except:
-            count = await db.quotes.count_documents({})
-            return str(count + 1)
-    return "1"
+            cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+            archived = await archive_quotes(cutoff)
+            if archived:
+                logger.info("Archived %d quotes last updated before %s", archived, cutoff.date())
+        except Exception:
+            logger.exception("Quote archival failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+async def unarchive_quote(tenant_id: str, quote_id: str) -> Optional[Dict[str, Any]]:
+    """Moves an archived quote back to the hot collection and returns it"""
+    query = {"tenant_id": tenant_id, "id": quote_id}
+    archived = await db.archived_quotes.find_one(query)
+    if archived is None:
+        return None
+    try:
+        await db.quotes.insert_one(pack_large_items(thaw_quote(archived)))
+    except DuplicateKeyError:
+        pass  # restored by a concurrent request
+    await db.archived_quotes.delete_one({"_id": archived["_id"]})
+    return await db.quotes.find_one(query)
 
 # Routes
 @api_router.get("/")
@@ -153,122 +1599,620 @@ async def root():
 
 # Company routes
 @api_router.get("/company", response_model=CompanyInfo)
-async def get_company_info():
-    company = await db.company.find_one({})
-    if not company:
-        # Create default company info
-        default_company = CompanyInfo()
-        await db.company.insert_one(default_company.dict())
-        return default_company
-    return CompanyInfo(**company)
+async def get_company_info(tenant_id: str = Depends(current_tenant)):
+    company, _ = await company_cache.get(tenant_id)
+    return company
 
 @api_router.put("/company", response_model=CompanyInfo)
-async def update_company_info(company: CompanyInfo):
+async def update_company_info(company: CompanyInfo, tenant_id: str = Depends(current_tenant)):
     company_dict = company.dict()
-    company_dict["updated_date"] = datetime.now(timezone.utc).isoformat()
+    company_dict["updated_date"] = datetime.now(timezone.utc)
     
-    await db.company.delete_many({})  # Remove old company info
-    await db.company.insert_one(company_dict)
+    # One atomic write; a tenant's first PUT creates its company
+    await db.companies.replace_one({"tenant_id": tenant_id}, {"tenant_id": tenant_id, **company_dict}, upsert=True)
+    company_cache.invalidate(tenant_id)
     return company
 
 @api_router.post("/company/logo")
-async def upload_logo(file: UploadFile = File(...)):
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    filename = f"logo_{uuid.uuid4()}{file_extension}"
-    file_path = UPLOAD_DIR / filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+async def upload_logo(file: UploadFile = File(...), tenant_id: str = Depends(current_tenant)):
+    # Stream the upload in chunks: sniff the type from the first bytes, hash and
+    # size-check as we go, and do the blocking file writes in the threadpool
+    hasher = hashlib.sha256()
+    tmp_path = UPLOAD_DIR / f".upload_{uuid.uuid4().hex}.tmp"
+    file_extension = None
+    total_size = 0
+    try:
+        async with ThreadedFileSink(tmp_path) as sink:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                if file_extension is None:
+                    file_extension = sniff_image_extension(chunk)
+                    if file_extension is None:
+                        raise HTTPException(status_code=400, detail="File must be an image")
+                total_size += len(chunk)
+                if total_size > MAX_LOGO_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File exceeds {MAX_LOGO_SIZE} bytes")
+                hasher.update(chunk)
+                await sink.write(chunk)
+        if file_extension is None:
+            raise HTTPException(status_code=400, detail="File is empty")
+
+        filename = f"logo_{hasher.hexdigest()}{file_extension}"
+        file_path = UPLOAD_DIR / filename
+        # Same logo uploaded before - reuse the existing file
+        await run_in_threadpool(commit_upload, tmp_path, file_path)
+    finally:
+        await run_in_threadpool(tmp_path.unlink, True)
     
     # Update company info with logo path
-    await db.company.update_one(
-        {},
-        {"$set": {"logo_path": f"/api/uploads/{filename}"}},
+    await db.companies.update_one(
+        {"tenant_id": tenant_id},
+        {"$set": {"logo_path": f"/api/uploads/{filename}", "updated_date": datetime.now(timezone.utc)}},
         upsert=True
     )
+    company_cache.invalidate(tenant_id)
     
     return {"logo_path": f"/api/uploads/{filename}"}
 
 @api_router.get("/uploads/{filename}")
-async def get_uploaded_file(filename: str):
-    file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
+async def get_uploaded_file(filename: str, request: Request):
+    file_path = resolve_upload_path(filename)
+    try:
+        stat_result = file_path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+
+    etag = upload_etag(filename, stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    cache_headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if CONTENT_HASH_FILENAME_RE.match(filename) else REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+
+    # Conditional requests: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=cache_headers)
+    elif request.headers.get("if-modified-since") and not_modified_since(request.headers["if-modified-since"], stat_result.st_mtime):
+        return Response(status_code=304, headers=cache_headers)
+
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    file_size = stat_result.st_size
+
+    # Byte ranges (ignored if If-Range no longer matches the current representation)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+        byte_range = parse_byte_range(range_header, file_size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers = {
+                **cache_headers,
+                "Content-Range": f"bytes {start}-{end}/{file_size}",
+                "Content-Length": str(end - start + 1),
+            }
+            return StreamingResponse(
+                iter_file_range(file_path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers=headers
+            )
+
+    return FileResponse(file_path, media_type=media_type, headers=cache_headers, stat_result=stat_result)
 
 # Quote routes
 @api_router.post("/quotes", response_model=Quote)
-async def create_quote(quote_data: QuoteCreate):
-    quote_number = await get_next_quote_number()
-    quote_dict = quote_data.dict()
+@idempotent("create_quote")
+async def create_quote(quote_data: QuoteCreate, request: Request, tenant_id: str = Depends(current_tenant)):
+    quote_obj = await insert_new_quote(tenant_id, quote_data.dict())
+    return FastJSONResponse(quote_obj.model_dump())
+
+@api_router.post("/quotes/{quote_id}/clone", response_model=Quote)
+@idempotent("clone_quote")
+async def clone_quote(
+    quote_id: str,
+    request: Request,
+    changes: Optional[QuoteUpdate] = None,
+    tenant_id: str = Depends(current_tenant),
+):
+    """A new quote (fresh number, version 1) copied from an existing one, with optional field changes"""
+    source = await find_quote(tenant_id, quote_id, QUOTE_PROJECTION)
+    if not source:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    quote_dict = {name: value for name, value in quote_response_dict(source).items() if name in QuoteCreate.model_fields}
+    if changes:
+        quote_dict.update(changes.dict(exclude_none=True))
+    quote_obj = await insert_new_quote(tenant_id, quote_dict)
+    return FastJSONResponse(quote_obj.model_dump())
+
+def quote_document(tenant_id: str, quote_obj: Quote) -> Dict[str, Any]:
+    """What a new quote is stored as, before pack_large_items"""
+    quote_doc = quote_obj.dict()
+    quote_doc["tenant_id"] = tenant_id
+    quote_doc["render_model"] = build_render_model(quote_obj)
+    return quote_doc
+
+async def insert_new_quote(tenant_id: str, quote_dict: Dict[str, Any]) -> Quote:
+    quote_number = await get_next_quote_number(tenant_id)
     quote_dict["id"] = str(uuid.uuid4())
     quote_dict["quote_number"] = quote_number
-    quote_dict["created_date"] = datetime.now(timezone.utc).isoformat()
-    quote_dict["updated_date"] = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
+    quote_dict["created_date"] = now
+    quote_dict["updated_date"] = now
     
     quote_obj = Quote(**quote_dict)
-    await db.quotes.insert_one(quote_obj.dict())
+    quote_doc = pack_large_items(quote_document(tenant_id, quote_obj))
+    await db.quotes.insert_one(quote_doc)
+    await record_quote_revision(None, quote_doc)
     return quote_obj
 
 @api_router.get("/quotes", response_model=List[Quote])
-async def get_quotes(skip: int = 0, limit: int = 100):
-    quotes = await db.quotes.find().sort("created_date", -1).skip(skip).limit(limit).to_list(limit)
-    return [Quote(**quote) for quote in quotes]
+async def get_quotes(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    tenant_id: str = Depends(current_tenant),
+):
+    query = {"tenant_id": tenant_id, **created_range_query(date_from, date_to)}
+    # Archival goes by updated_date, so any range can reach into the archive; the page
+    # is cut from the first skip + limit quotes of each collection, newest first
+    window = skip + limit
+    hot = read_db.quotes.find(query, QUOTE_PROJECTION).sort("created_date", -1).limit(window)
+    archived = read_db.archived_quotes.find(query, archive_projection(QUOTE_PROJECTION)).sort("created_date", -1).limit(window)
+    quotes = []
+    async for quote in merge_by_created_date(aiter(hot), (thaw_quote(quote) async for quote in archived), newest_first=True):
+        if len(quotes) == window:
+            break
+        quotes.append(quote)
+    return FastJSONResponse([quote_response_dict(quote) for quote in quotes[skip:]])
+
+@api_router.get("/quotes/events")
+async def get_quote_events(request: Request, tenant_id: str = Depends(current_tenant)):
+    """Server-sent events for the tenant's quote inserts, updates and deletes"""
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    return StreamingResponse(
+        quote_event_stream(tenant_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @api_router.get("/quotes/{quote_id}", response_model=Quote)
-async def get_quote(quote_id: str):
-    quote = await db.quotes.find_one({"id": quote_id})
+async def get_quote(quote_id: str, request: Request, tenant_id: str = Depends(current_tenant)):
+    not_modified = await quote_not_modified(request, tenant_id, quote_id)
+    if not_modified:
+        return not_modified
+    quote = await find_quote(tenant_id, quote_id, QUOTE_PROJECTION)
     if not quote:
         raise HTTPException(status_code=404, detail="Quote not found")
-    return Quote(**quote)
+    headers = {"ETag": quote_etag(quote), "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    return FastJSONResponse(quote_response_dict(quote), headers=headers)
 
 @api_router.put("/quotes/{quote_id}", response_model=Quote)
-async def update_quote(quote_id: str, quote_update: QuoteUpdate):
-    existing_quote = await db.quotes.find_one({"id": quote_id})
+async def update_quote(quote_id: str, quote_update: QuoteUpdate, tenant_id: str = Depends(current_tenant)):
+    existing_quote = await db.quotes.find_one({"tenant_id": tenant_id, "id": quote_id})
+    if not existing_quote:
+        existing_quote = await unarchive_quote(tenant_id, quote_id)
     if not existing_quote:
         raise HTTPException(status_code=404, detail="Quote not found")
+    unpack_items(existing_quote)
     
     update_data = {k: v for k, v in quote_update.dict().items() if v is not None}
-    update_data["updated_date"] = datetime.now(timezone.utc).isoformat()
-    
-    await db.quotes.update_one({"id": quote_id}, {"$set": update_data})
-    
-    updated_quote = await db.quotes.find_one({"id": quote_id})
-    return Quote(**updated_quote)
+    update_data["updated_date"] = datetime.now(timezone.utc)
+    
+    stored_version = existing_quote.get("version")
+    previous_quote = {**existing_quote, "version": stored_version or 1}
+    if stored_version is None:
+        # Quote predates revision history: keep its current state as version 1
+        await record_quote_revision(None, previous_quote)
+    update_data["version"] = previous_quote["version"] + 1
+    update_data["render_model"] = build_render_model(Quote(**{**existing_quote, **update_data}))
+    update = {"$set": update_data}
+    if "items" in update_data:
+        # New items may cross the columnar threshold either way
+        pack_large_items(update_data)
+        update["$unset"] = {"items" if "items_packed" in update_data else "items_packed": ""}
+    
+    # Only apply the update if nobody else changed the quote since we read it
+    result = await db.quotes.update_one({"tenant_id": tenant_id, "id": quote_id, "version": stored_version}, update)
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Quote was modified concurrently, please retry")
+    
+    updated_quote = await db.quotes.find_one({"tenant_id": tenant_id, "id": quote_id})
+    await record_quote_revision(previous_quote, updated_quote)
+    schedule_thumbnail_refresh(tenant_id, quote_id)
+    return Quote(**unpack_items(updated_quote))
 
 @api_router.delete("/quotes/{quote_id}")
-async def delete_quote(quote_id: str):
-    result = await db.quotes.delete_one({"id": quote_id})
+async def delete_quote(quote_id: str, tenant_id: str = Depends(current_tenant)):
+    result = await db.quotes.delete_one({"tenant_id": tenant_id, "id": quote_id})
+    if result.deleted_count == 0:
+        result = await db.archived_quotes.delete_one({"tenant_id": tenant_id, "id": quote_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Quote not found")
+    await db.quote_revisions.delete_many({"quote_id": quote_id})
+    quote_events.note_deleted(quote_id, tenant_id)
     return {"message": "Quote deleted successfully"}
 
-# Export routes
-@api_router.get("/quotes/{quote_id}/export/excel")
-async def export_quote_excel(quote_id: str):
-    quote = await db.quotes.find_one({"id": quote_id})
-    if not quote:
+# Revision history routes
+async def require_tenant_quote(tenant_id: str, quote_id: str):
+    # Revisions are keyed by quote id alone, so check the quote belongs to the tenant first
+    if not await find_quote(tenant_id, quote_id, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Quote not found")
-    
-    quote_obj = Quote(**quote)
-    company = await get_company_info()
-    
+
+@api_router.get("/quotes/{quote_id}/revisions", response_model=List[QuoteRevision])
+async def get_quote_revisions(quote_id: str, tenant_id: str = Depends(current_tenant)):
+    await require_tenant_quote(tenant_id, quote_id)
+    revisions = await db.quote_revisions.find(
+        {"quote_id": quote_id},
+        {"_id": 0, "snapshot": 0, "diff": 0}
+    ).sort("version", -1).to_list(None)
+    return [QuoteRevision(**revision) for revision in revisions]
+
+@api_router.get("/quotes/{quote_id}/revisions/{version}", response_model=Quote)
+async def get_quote_revision(quote_id: str, version: int, tenant_id: str = Depends(current_tenant)):
+    await require_tenant_quote(tenant_id, quote_id)
+    quote = await load_quote_version(quote_id, version)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return Quote(**quote)
+
+# Item catalog: reusable line items (description, unit, price) per tenant. Search
+# matches a prefix of the description, of any word in it, or of the code, through
+# an anchored regex on the indexed search_keys array. Arabic is matched without
+# diacritics and with the alef forms folded. Lookups by id are cached per worker.
+CATALOG_PROJECTION = {"_id": 0, **{field: 1 for field in CatalogItem.model_fields}}
+CATALOG_SEARCH_LIMIT = 100
+# Keys (and so queries) are cut to this many characters, which keeps the keys of
+# a description linear in its length rather than quadratic
+CATALOG_SEARCH_KEY_LENGTH = 32
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", 5000))
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 60))
+ARABIC_DIACRITICS_RE = re.compile("[\u064B-\u0652\u0640]")  # harakat and tatweel
+ALEF_FORMS = str.maketrans("\u0623\u0625\u0622", "\u0627\u0627\u0627")  # alef with hamza / madda -> bare alef
+
+def catalog_search_key(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = ARABIC_DIACRITICS_RE.sub("", text).translate(ALEF_FORMS)
+    return " ".join(text.split())
+
+def catalog_search_prefix(text: str) -> str:
+    return catalog_search_key(text)[:CATALOG_SEARCH_KEY_LENGTH].rstrip()
+
+def catalog_search_keys(item: Dict[str, Any]) -> List[str]:
+    words = catalog_search_key(item["description"]).split()
+    keys = [catalog_search_prefix(" ".join(words[start:])) for start in range(len(words))]
+    if item.get("code"):
+        keys.append(catalog_search_prefix(item["code"]))
+    return list(dict.fromkeys(keys))
+
+class CatalogCache:
+    """LRU of catalog items by (tenant, id). Edits through this worker invalidate
+    their entry; other workers see them within the TTL."""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, tenant_id: str, item_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        found, missing = {}, []
+        now = time.monotonic()
+        for item_id in dict.fromkeys(item_ids):
+            entry = self.entries.get((tenant_id, item_id))
+            if entry and now - entry[0] < self.ttl:
+                self.entries.move_to_end((tenant_id, item_id))
+                found[item_id] = entry[1]
+            else:
+                missing.append(item_id)
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            async for item in db.catalog_items.find({"tenant_id": tenant_id, "id": {"$in": missing}}, CATALOG_PROJECTION):
+                self.entries[(tenant_id, item["id"])] = (now, item)
+                self.entries.move_to_end((tenant_id, item["id"]))
+                found[item["id"]] = item
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return found
+
+    def invalidate(self, tenant_id: str, item_id: str):
+        self.entries.pop((tenant_id, item_id), None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+catalog_cache = CatalogCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+class CatalogLookup(BaseModel):
+    ids: List[str] = Field(max_length=1000)
+
+@api_router.post("/catalog", response_model=CatalogItem)
+async def create_catalog_item(item_data: CatalogItemCreate, tenant_id: str = Depends(current_tenant)):
+    item = CatalogItem(**item_data.dict())
+    item_doc = item.dict()
+    await db.catalog_items.insert_one({**item_doc, "tenant_id": tenant_id, "search_keys": catalog_search_keys(item_doc)})
+    return item
+
+@api_router.get("/catalog", response_model=List[CatalogItem])
+async def search_catalog(
+    q: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=CATALOG_SEARCH_LIMIT),
+    tenant_id: str = Depends(current_tenant),
+):
+    """Catalog items whose description, a word of it, or code starts with `q`"""
+    query = {"tenant_id": tenant_id}
+    if q and catalog_search_prefix(q):
+        query["search_keys"] = {"$regex": "^" + re.escape(catalog_search_prefix(q))}
+    items = await read_db.catalog_items.find(query, CATALOG_PROJECTION).sort("description", 1).limit(limit).to_list(limit)
+    return FastJSONResponse(items)
+
+@api_router.post("/catalog/lookup")
+async def lookup_catalog_items(lookup: CatalogLookup, tenant_id: str = Depends(current_tenant)):
+    """Current description, unit and price of many catalog items in one call, keyed by id; unknown ids are left out"""
+    items = await catalog_cache.get_many(tenant_id, lookup.ids)
+    return FastJSONResponse(items)
+
+@api_router.get("/catalog/{item_id}", response_model=CatalogItem)
+async def get_catalog_item(item_id: str, tenant_id: str = Depends(current_tenant)):
+    item = (await catalog_cache.get_many(tenant_id, [item_id])).get(item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Catalog item not found")
+    return FastJSONResponse(item)
+
+@api_router.put("/catalog/{item_id}", response_model=CatalogItem)
+async def update_catalog_item(item_id: str, item_data: CatalogItemCreate, tenant_id: str = Depends(current_tenant)):
+    update = {**item_data.dict(), "updated_date": datetime.now(timezone.utc)}
+    update["search_keys"] = catalog_search_keys(update)
+    item = await db.catalog_items.find_one_and_update(
+        {"tenant_id": tenant_id, "id": item_id},
+        {"$set": update},
+        projection=CATALOG_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if not item:
+        raise HTTPException(status_code=404, detail="Catalog item not found")
+    catalog_cache.invalidate(tenant_id, item_id)
+    return FastJSONResponse(item)
+
+@api_router.delete("/catalog/{item_id}")
+async def delete_catalog_item(item_id: str, tenant_id: str = Depends(current_tenant)):
+    """Quotes keep their copied lines; only the catalog entry goes"""
+    result = await db.catalog_items.delete_one({"tenant_id": tenant_id, "id": item_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Catalog item not found")
+    catalog_cache.invalidate(tenant_id, item_id)
+    return {"message": "Catalog item deleted successfully"}
+
+# Memory accounting for export renders (instrumentation mode). tracemalloc is
+# process-wide, so measured renders are serialized to keep their numbers apart.
+EXPORT_MEMORY_TRACKING = os.environ.get("EXPORT_MEMORY_TRACKING", "0") == "1"
+MEMORY_TOP_SITES = 10
+
+class RenderMemoryTracker:
+    """Peak traced bytes, top allocation sites and output size per export render"""
+
+    def __init__(self, keep: int = 50):
+        self.lock = threading.Lock()
+        self.recent = collections.deque(maxlen=keep)
+        self.totals: Dict[str, Dict[str, int]] = {}
+        self._local = threading.local()
+
+    def measure(self, export_format: str, renderer, *args) -> bytes:
+        with self.lock:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.clear_traces()
+            tracemalloc.reset_peak()
+            self._local.active = True
+            self._local.snapshot = None
+            started = time.perf_counter()
+            try:
+                content = renderer(*args)
+            finally:
+                self._local.active = False
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = self._local.snapshot
+                if started_tracing:
+                    tracemalloc.stop()
+        record = {
+            "format": export_format,
+            "peak_bytes": peak,
+            "output_bytes": len(content),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "top_sites": self._top_sites(snapshot),
+        }
+        self.recent.append(record)
+        totals = self.totals.setdefault(export_format, {"renders": 0, "peak_bytes_max": 0, "peak_bytes_sum": 0, "output_bytes_sum": 0})
+        totals["renders"] += 1
+        totals["peak_bytes_max"] = max(totals["peak_bytes_max"], peak)
+        totals["peak_bytes_sum"] += peak
+        totals["output_bytes_sum"] += len(content)
+        return content
+
+    def checkpoint(self):
+        """Renderers call this once the document is fully built in memory, just before serializing it"""
+        if getattr(self._local, "active", False):
+            self._local.snapshot = tracemalloc.take_snapshot()
+
+    def _top_sites(self, snapshot) -> List[Dict[str, Any]]:
+        if snapshot is None:
+            return []
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [
+            {
+                "site": f"{os.path.join(*Path(stat.traceback[0].filename).parts[-2:])}:{stat.traceback[0].lineno}",
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP_SITES]
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        per_format = {
+            fmt: {
+                "renders": t["renders"],
+                "peak_bytes_max": t["peak_bytes_max"],
+                "peak_bytes_avg": t["peak_bytes_sum"] // t["renders"],
+                "output_bytes_avg": t["output_bytes_sum"] // t["renders"],
+            }
+            for fmt, t in self.totals.items()
+        }
+        return {"enabled": EXPORT_MEMORY_TRACKING, "formats": per_format, "recent": list(self.recent)[-10:]}
+
+render_memory = RenderMemoryTracker()
+
+# Render model: the strings the exporters derive from a quote (formatted dates,
+# wrapped text, labelled customer fields), built when the quote is written and
+# stored on it so that rendering is layout only. Item rows are not stored: they
+# would repeat every item as strings and more than double large documents,
+# while formatting them per export is cheap (item_rows()). Company fields change
+# independently of quotes and are still formatted by the renderers.
+# Bump RENDER_MODEL_VERSION whenever build_render_model changes; stored models
+# of an older version are rebuilt on the next export.
+RENDER_MODEL_VERSION = 2
+NOT_SPECIFIED = "غير محدد"
+QUOTE_RENDER_PROJECTION = {**QUOTE_PROJECTION, "render_model": 1}
+
+def build_render_model(quote_obj: Quote) -> Dict[str, Any]:
+    customer = quote_obj.customer
+    return {
+        "template_version": RENDER_MODEL_VERSION,
+        "title": f"عرض سعر رقم {quote_obj.quote_number}",
+        "date": quote_obj.created_date.strftime("%B %d, %Y"),
+        "customer_lines": [
+            f"العميل: {customer.name}",
+            f"الرقم الضريبي: {customer.tax_number or NOT_SPECIFIED}",
+            f"الشارع: {customer.street or NOT_SPECIFIED}",
+            f"الحي: {customer.neighborhood or NOT_SPECIFIED}",
+            f"المدينة: {customer.city or NOT_SPECIFIED}",
+            f"الدولة: {customer.country or 'السعودية'}",
+            f"السجل التجاري: {customer.commercial_registration or NOT_SPECIFIED}",
+            f"المبنى: {customer.building or NOT_SPECIFIED}",
+            f"الرمز البريدي: {customer.postal_code or NOT_SPECIFIED}",
+            f"الرقم الإضافي: {customer.additional_number or NOT_SPECIFIED}",
+            f"رقم الهاتف: {customer.phone or NOT_SPECIFIED}",
+        ],
+        "description_lines": textwrap.wrap(quote_obj.project_description, width=80)[:3],
+        "location": quote_obj.location or NOT_SPECIFIED,
+        "totals": [
+            ["المجموع الفرعي:", f"{quote_obj.subtotal:,.2f} ريال"],
+            ["ضريبة القيمة المضافة (15%):", f"{quote_obj.tax_amount:,.2f} ريال"],
+            ["المبلغ الإجمالي:", f"{quote_obj.total_amount:,.2f} ريال"],
+        ],
+        "notes_lines": textwrap.wrap(quote_obj.notes, width=100)[:4] if quote_obj.notes else [],
+        "sheet_title": f"Quote_{quote_obj.quote_number}",
+        "sheet_header": [
+            f"Quote #{quote_obj.quote_number}",
+            f"Customer: {quote_obj.customer.name}",
+            f"Project: {quote_obj.project_description}",
+            f"Location: {quote_obj.location}",
+        ],
+    }
+
+def item_rows(quote_obj: Quote) -> List[Tuple[str, ...]]:
+    """serial, description, description truncated for the PDF, quantity, unit, unit price, total"""
+    return [
+        (
+            str(i),
+            item.description,
+            item.description[:35] + "..." if len(item.description) > 35 else item.description,
+            f"{item.quantity:g}",
+            item.unit,
+            f"{item.unit_price:,.2f}",
+            f"{item.total_price:,.2f}",
+        )
+        for i, item in enumerate(quote_obj.items, 1)
+    ]
+
+def render_model(quote_obj: Quote) -> Dict[str, Any]:
+    """The stored render model if it matches the current template, otherwise a fresh one"""
+    model = quote_obj._render_model
+    if not model or model.get("template_version") != RENDER_MODEL_VERSION:
+        model = quote_obj._render_model = build_render_model(quote_obj)
+    return model
+
+def quote_for_render(quote: Dict[str, Any]) -> Quote:
+    if "items_packed" in quote:
+        # Trusted document: skip validating thousands of items and keep them columnar
+        fields = {name: quote[name] for name in Quote.model_fields if name in quote}
+        fields["customer"] = CustomerInfo(**quote["customer"])
+        fields["items"] = PackedItems(quote["items_packed"])
+        quote_obj = Quote.model_construct(**fields)
+    else:
+        quote_obj = Quote(**quote)
+    quote_obj._render_model = quote.get("render_model")
+    return quote_obj
+
+async def quote_for_export(quote: Dict[str, Any]) -> Quote:
+    """Like quote_for_render, storing a rebuilt model when the stored one is missing or outdated"""
+    quote_obj = quote_for_render(quote)
+    stored = quote_obj._render_model
+    model = render_model(quote_obj)
+    if model is not stored:
+        # Guarded on version so a concurrent edit (which writes its own model) wins
+        await db.quotes.update_one(
+            {"tenant_id": quote["tenant_id"], "id": quote_obj.id, "version": quote.get("version")},
+            {"$set": {"render_model": model}}
+        )
+    return quote_obj
+
+# Export rendering
+# Renderers are plain functions of (quote, company) -> file bytes; they run in the
+# threadpool so a large export does not stall the event loop. Output is
+# byte-reproducible: document dates are pinned to the quote's updated_date and
+# ids are derived from the content, so the same revision always yields the same file.
+OOXML_CORE_PROPERTIES = "docProps/core.xml"
+OOXML_DATE_RE = re.compile(rb"(<dcterms:(?:created|modified)\b[^>]*>)[^<]*(</dcterms:)")
+
+def pinned_moment(quote_obj: Quote) -> datetime:
+    return as_utc(quote_obj.updated_date).replace(microsecond=0)
+
+def pin_ooxml_package(data: bytes, moment: datetime) -> bytes:
+    """Rewrites an xlsx/docx zip with fixed member timestamps and core dates.
+    openpyxl stamps the save time into core.xml and both libraries stamp the
+    wall clock on every zip member."""
+    date_time = moment.timetuple()[:6]
+    stamp = moment.strftime("%Y-%m-%dT%H:%M:%SZ").encode()
+    output = BytesIO()
+    with ZipFile(BytesIO(data)) as source, ZipFile(output, "w", ZIP_DEFLATED) as target:
+        for member in source.infolist():
+            content = source.read(member)
+            if member.filename == OOXML_CORE_PROPERTIES:
+                content = OOXML_DATE_RE.sub(lambda m: m.group(1) + stamp + m.group(2), content)
+            info = ZipInfo(member.filename, date_time=date_time)
+            info.compress_type = ZIP_DEFLATED
+            info.external_attr = member.external_attr
+            target.writestr(info, content)
+    return output.getvalue()
+
+def pin_pdf_metadata(c, moment: datetime, fingerprint: str):
+    """Invariant mode drops ReportLab's timestamp-seeded id; pin the info dates to
+    the quote and seed the document id from the quote revision instead"""
+    pdf_date = moment.strftime("D:%Y%m%d%H%M%S+00'00'")
+    c.setDateFormatter(lambda *_: pdf_date)
+    c._doc.updateSignature(fingerprint)
+
+def render_excel(quote_obj: Quote, company: CompanyInfo) -> bytes:
     # Create Excel workbook
+    model = render_model(quote_obj)
     wb = Workbook()
     ws = wb.active
-    ws.title = f"Quote_{quote_obj.quote_number}"
+    ws.title = model["sheet_title"]
     
     # Headers
-    ws.append([f"Quote #{quote_obj.quote_number}"])
+    quote_line, *quote_details = model["sheet_header"]
+    ws.append([quote_line])
     ws.append([f"Company: {company.name_ar}"])
-    ws.append([f"Customer: {quote_obj.customer.name}"])
-    ws.append([f"Project: {quote_obj.project_description}"])
-    ws.append([f"Location: {quote_obj.location}"])
+    for line in quote_details:
+        ws.append([line])
     ws.append([])
     
     # Items table
@@ -281,117 +2225,177 @@ async def export_quote_excel(quote_id: str):
     ws.append(["", "", "", "", "Tax (15%):", quote_obj.tax_amount])
     ws.append(["", "", "", "", "Total:", quote_obj.total_amount])
     
+    render_memory.checkpoint()
+    
     # Save to BytesIO
     output = BytesIO()
     wb.save(output)
-    output.seek(0)
-    
-    headers = {
-        'Content-Disposition': f'attachment; filename="quote_{quote_obj.quote_number}.xlsx"'
-    }
-    
-    return StreamingResponse(
-        BytesIO(output.read()),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers
-    )
+    return pin_ooxml_package(output.getvalue(), pinned_moment(quote_obj))
+
+# Arabic text in PDFs: strings are reshaped into presentation forms, reordered
+# for right-to-left display and drawn with an Arabic TTF. ReportLab embeds only
+# the glyphs a document uses (a subset font per document). Shaping results are
+# memoized because the same labels and company fields repeat on every export.
+# The bundled DejaVu Sans covers Latin and Arabic including the presentation
+# forms; PDF_ARABIC_FONT(_BOLD) can point at another TrueType face.
+FONTS_DIR = ROOT_DIR / "fonts"
+PDF_ARABIC_FONT = os.environ.get("PDF_ARABIC_FONT", str(FONTS_DIR / "DejaVuSans.ttf"))
+PDF_ARABIC_FONT_BOLD = os.environ.get("PDF_ARABIC_FONT_BOLD", str(FONTS_DIR / "DejaVuSans-Bold.ttf"))
+SHAPED_TEXT_CACHE_SIZE = int(os.environ.get("SHAPED_TEXT_CACHE_SIZE", 4096))
+ARABIC_RE = re.compile("[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]")
+
+@functools.lru_cache(maxsize=None)
+def arabic_pdf_fonts() -> Dict[str, str]:
+    """Registers the Arabic TTFs with ReportLab on first use; maps base font -> Arabic font"""
+    fonts = {}
+    if arabic_reshaper is None:
+        logger.warning("arabic-reshaper/python-bidi not installed; Arabic text in PDFs will not be shaped")
+        return fonts
+    for base_font, font_name, font_path in (
+        ("Helvetica", "Arabic", PDF_ARABIC_FONT),
+        ("Helvetica-Bold", "Arabic-Bold", PDF_ARABIC_FONT_BOLD),
+    ):
+        if os.path.isfile(font_path):
+            pdfmetrics.registerFont(TTFont(font_name, font_path))
+            fonts[base_font] = font_name
+    if "Helvetica" in fonts:
+        fonts.setdefault("Helvetica-Bold", fonts["Helvetica"])
+    else:
+        logger.warning("Arabic font %s not found; Arabic text in PDFs will not be shaped", PDF_ARABIC_FONT)
+        fonts.clear()
+    return fonts
+
+@functools.lru_cache(maxsize=SHAPED_TEXT_CACHE_SIZE)
+def shape_pdf_text(text: str, font_name: str) -> Tuple[str, str]:
+    """Text in visual order plus the font to draw it with"""
+    fonts = arabic_pdf_fonts()
+    if font_name not in fonts or not ARABIC_RE.search(text):
+        return text, font_name
+    return get_display(arabic_reshaper.reshape(text)), fonts[font_name]
+
+def company_lines(company: CompanyInfo) -> List[str]:
+    """Seller column of the party table, row-aligned with the render model's customer_lines"""
+    return [
+        f"الشركة: {company.name_ar}",
+        f"الرقم الضريبي: {company.tax_number}",
+        f"الشارع: {company.street}",
+        f"الحي: {company.neighborhood}",
+        f"المدينة: {company.city}",
+        f"الدولة: {company.country}",
+        f"السجل التجاري: {company.commercial_registration}",
+        f"المبنى: {company.building}",
+        f"الرمز البريدي: {company.postal_code}",
+        f"الرقم الإضافي: {company.additional_number}",
+        "",
+    ]
+
+# PDF layout, matching the preview. The page furniture that only depends on the
+# company (logo and names) is drawn once per document into a form XObject and
+# placed on each quote's first page, so a merged export carries it a single time.
+PDF_MARGIN = 20 * mm
+PDF_COMPANY_HEADER_FORM = "company_header"
+PDF_LOGO_SIZE = 60
+
+def draw_text_right_aligned(canvas, text, x, y, font_name="Helvetica", font_size=10):
+    """Draw right-aligned text with UTF-8 support"""
+    text, font_name = shape_pdf_text(str(text), font_name)
+    canvas.setFont(font_name, font_size)
+    text_width = canvas.stringWidth(text, font_name, font_size)
+    canvas.drawString(x - text_width, y, text)
+    return text_width
+
+def draw_text_center_aligned(canvas, text, x, y, font_name="Helvetica", font_size=10):
+    """Draw center-aligned text"""
+    text, font_name = shape_pdf_text(str(text), font_name)
+    canvas.setFont(font_name, font_size)
+    text_width = canvas.stringWidth(text, font_name, font_size)
+    canvas.drawString(x - text_width/2, y, text)
+
+def draw_bordered_box(canvas, x, y, width, height, fill_color=None):
+    """Draw a bordered box"""
+    if fill_color:
+        canvas.setFillColor(fill_color)
+        canvas.rect(x, y - height, width, height, fill=1, stroke=1)
+        canvas.setFillColor(colors.black)
+    else:
+        canvas.rect(x, y - height, width, height, fill=0, stroke=1)
+
+def company_logo_file(company: CompanyInfo) -> Optional[Path]:
+    if not company.logo_path:
+        return None
+    try:
+        path = resolve_upload_path(company.logo_path.rsplit("/", 1)[-1])
+    except HTTPException:
+        return None
+    return path if path.is_file() else None
+
+def draw_pdf_company_header(c, company: CompanyInfo):
+    """Defines the company header form; call once per canvas before draw_pdf_quote"""
+    from reportlab.lib.utils import ImageReader
+
+    width, height = A4
+    content_width = width - 2 * PDF_MARGIN
+    y_position = height - PDF_MARGIN
+
+    c.beginForm(PDF_COMPANY_HEADER_FORM)
+
+    # Logo area (left side)
+    logo_file = company_logo_file(company)
+    if logo_file:
+        try:
+            c.drawImage(ImageReader(str(logo_file)), PDF_MARGIN, y_position - PDF_LOGO_SIZE,
+                        width=PDF_LOGO_SIZE, height=PDF_LOGO_SIZE, preserveAspectRatio=True, mask="auto")
+        except Exception:
+            logger.warning("Could not embed company logo %s", logo_file, exc_info=True)
+
+    # Company info (center)
+    company_center_x = PDF_MARGIN + content_width / 2
+
+    # Company name (Arabic) - large bold
+    c.setFont("Helvetica-Bold", 18)
+    draw_text_center_aligned(c, company.name_ar or "شركة مثلث الأنظمة المميزة للمقاولات",
+                             company_center_x, y_position - 10)
 
-@api_router.get("/quotes/{quote_id}/export/pdf")
-async def export_quote_pdf(quote_id: str):
-    quote = await db.quotes.find_one({"id": quote_id})
-    if not quote:
-        raise HTTPException(status_code=404, detail="Quote not found")
-    
-    quote_obj = Quote(**quote)
-    company = await get_company_info()
-    
-    # Create PDF using canvas to match exact preview layout
-    buffer = BytesIO()
-    
-    # Use basic canvas approach for pixel-perfect matching
-    from reportlab.pdfgen import canvas as pdf_canvas
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.units import mm
+    # Company description (Arabic)
+    c.setFont("Helvetica", 11)
+    draw_text_center_aligned(c, company.description_ar, company_center_x, y_position - 30)
+
+    # Company name (English)
+    c.setFont("Helvetica", 9)
+    draw_text_center_aligned(c, company.name_en, company_center_x, y_position - 45)
+
+    c.endForm()
+
+def draw_pdf_quote(c, quote_obj: Quote, company: CompanyInfo):
+    """Draws one quote starting on the current page, leaving its last page open"""
     from reportlab.lib import colors as pdf_colors
-    from reportlab.pdfbase.pdfmetrics import registerFont
-    from reportlab.pdfbase.ttfonts import TTFont
-    from reportlab.lib.utils import ImageReader
-    import textwrap
-    
-    # Create canvas
-    c = pdf_canvas.Canvas(buffer, pagesize=A4)
+
+    model = render_model(quote_obj)
     width, height = A4
     
     # Define measurements matching preview exactly
-    margin_left = 20 * mm
-    margin_right = 20 * mm 
-    margin_top = 20 * mm
-    margin_bottom = 20 * mm
+    margin_left = PDF_MARGIN
+    margin_right = PDF_MARGIN
+    margin_top = PDF_MARGIN
+    margin_bottom = PDF_MARGIN
     
     content_width = width - margin_left - margin_right
     y_position = height - margin_top
     
-    def draw_text_right_aligned(canvas, text, x, y, font_name="Helvetica", font_size=10):
-        """Draw right-aligned text with UTF-8 support"""
-        canvas.setFont(font_name, font_size)
-        text_width = canvas.stringWidth(str(text), font_name, font_size)
-        canvas.drawString(x - text_width, y, str(text))
-        return text_width
-    
-    def draw_text_center_aligned(canvas, text, x, y, font_name="Helvetica", font_size=10):
-        """Draw center-aligned text"""
-        canvas.setFont(font_name, font_size)
-        text_width = canvas.stringWidth(str(text), font_name, font_size)
-        canvas.drawString(x - text_width/2, y, str(text))
-    
-    def draw_bordered_box(canvas, x, y, width, height, fill_color=None):
-        """Draw a bordered box"""
-        if fill_color:
-            canvas.setFillColor(fill_color)
-            canvas.rect(x, y - height, width, height, fill=1, stroke=1)
-            canvas.setFillColor(pdf_colors.black)
-        else:
-            canvas.rect(x, y - height, width, height, fill=0, stroke=1)
-    
     # === PAGE 1: HEADER SECTION (exactly like preview) ===
     
     # Header layout: Logo | Company Info | Quote Badge
-    header_height = 80
-    
-    # Logo area (left side)
-    logo_x = margin_left
-    logo_width = 60
-    if company.logo_path:
-        # Would draw logo here if path exists
-        pass
-    
-    # Company info (center)
-    company_center_x = margin_left + content_width / 2
-    
-    # Company name (Arabic) - large bold
-    c.setFont("Helvetica-Bold", 18)
-    draw_text_center_aligned(c, company.name_ar or "شركة مثلث الأنظمة المميزة للمقاولات", 
-                           company_center_x, y_position - 10)
-    
-    # Company description (Arabic)
-    c.setFont("Helvetica", 11)
-    draw_text_center_aligned(c, company.description_ar, company_center_x, y_position - 30)
-    
-    # Company name (English)
-    c.setFont("Helvetica", 9)
-    draw_text_center_aligned(c, company.name_en, company_center_x, y_position - 45)
+    c.doForm(PDF_COMPANY_HEADER_FORM)
     
     # Quote badge (right side)
     quote_x = margin_left + content_width
     c.setFont("Helvetica-Bold", 14)
     c.setFillColor(pdf_colors.blue)
-    draw_text_right_aligned(c, f"عرض سعر رقم {quote_obj.quote_number}", 
-                          quote_x, y_position - 10)
+    draw_text_right_aligned(c, model["title"], quote_x, y_position - 10)
     
     c.setFillColor(pdf_colors.black)
     c.setFont("Helvetica", 10)
-    draw_text_right_aligned(c, quote_obj.created_date.strftime("%B %d, %Y"), 
-                          quote_x, y_position - 30)
+    draw_text_right_aligned(c, model["date"], quote_x, y_position - 30)
     
     y_position -= 100
     
@@ -411,19 +2415,7 @@ async def export_quote_pdf(quote_id: str):
     draw_text_center_aligned(c, "Customer / العميل", margin_left + col_width*1.5, table_y - 15)
     
     # Data rows
-    company_data = [
-        (f"الشركة: {company.name_ar}", f"العميل: {quote_obj.customer.name}"),
-        (f"الرقم الضريبي: {company.tax_number}", f"الرقم الضريبي: {quote_obj.customer.tax_number or 'غير محدد'}"),
-        (f"الشارع: {company.street}", f"الشارع: {quote_obj.customer.street or 'غير محدد'}"),
-        (f"الحي: {company.neighborhood}", f"الحي: {quote_obj.customer.neighborhood or 'غير محدد'}"),
-        (f"المدينة: {company.city}", f"المدينة: {quote_obj.customer.city or 'غير محدد'}"),
-        (f"الدولة: {company.country}", f"الدولة: {quote_obj.customer.country or 'السعودية'}"),
-        (f"السجل التجاري: {company.commercial_registration}", f"السجل التجاري: {quote_obj.customer.commercial_registration or 'غير محدد'}"),
-        (f"المبنى: {company.building}", f"المبنى: {quote_obj.customer.building or 'غير محدد'}"),
-        (f"الرمز البريدي: {company.postal_code}", f"الرمز البريدي: {quote_obj.customer.postal_code or 'غير محدد'}"),
-        (f"الرقم الإضافي: {company.additional_number}", f"الرقم الإضافي: {quote_obj.customer.additional_number or 'غير محدد'}"),
-        ("", f"رقم الهاتف: {quote_obj.customer.phone or 'غير محدد'}")
-    ]
+    company_data = list(zip(company_lines(company), model["customer_lines"]))
     
     row_y = table_y - row_height
     c.setFont("Helvetica", 9)
@@ -461,16 +2453,14 @@ async def export_quote_pdf(quote_id: str):
     draw_text_right_aligned(c, "وصف المشروع:", margin_left + 80, y_position - 15)
     c.setFont("Helvetica", 10)
     
-    # Wrap project description if too long
-    desc_lines = textwrap.wrap(quote_obj.project_description, width=80)
-    for i, line in enumerate(desc_lines[:3]):  # Max 3 lines
+    # Project description, wrapped to at most 3 lines
+    for i, line in enumerate(model["description_lines"]):
         draw_text_right_aligned(c, line, margin_left + content_width - 5, y_position - 15 - i*12)
     
     c.setFont("Helvetica-Bold", 10)
     draw_text_right_aligned(c, "الموقع:", margin_left + 50, y_position - 40)
     c.setFont("Helvetica", 10)
-    draw_text_right_aligned(c, quote_obj.location or "غير محدد", 
-                          margin_left + content_width - 5, y_position - 40)
+    draw_text_right_aligned(c, model["location"], margin_left + content_width - 5, y_position - 40)
     
     y_position -= 80
     
@@ -511,8 +2501,9 @@ async def export_quote_pdf(quote_id: str):
     # Data rows
     items_per_page = 15  # Limit to prevent page overflow
     row_height = 20
+    rows = item_rows(quote_obj)
     
-    for i, item in enumerate(quote_obj.items[:items_per_page], 1):
+    for serial, _, desc, quantity, unit, unit_price, total_price in rows[:items_per_page]:
         # Check if we need a new page
         if y_position - row_height < margin_bottom + 100:  # Leave space for totals
             c.showPage()  # New page
@@ -537,34 +2528,33 @@ async def export_quote_pdf(quote_id: str):
         c.setFont("Helvetica", 9)
         
         # Serial number (center)
-        draw_text_center_aligned(c, str(i), col_positions[0] + col_widths[0] * mm / 2, y_position - 13)
+        draw_text_center_aligned(c, serial, col_positions[0] + col_widths[0] * mm / 2, y_position - 13)
         
         # Description (right-aligned, truncated if needed)
-        desc = item.description[:35] + "..." if len(item.description) > 35 else item.description
         draw_text_right_aligned(c, desc, col_positions[1] + col_widths[1] * mm - 3, y_position - 13)
         
         # Quantity (center)
-        draw_text_center_aligned(c, f"{item.quantity:g}", col_positions[2] + col_widths[2] * mm / 2, y_position - 13)
+        draw_text_center_aligned(c, quantity, col_positions[2] + col_widths[2] * mm / 2, y_position - 13)
         
         # Unit (center)
-        draw_text_center_aligned(c, item.unit, col_positions[3] + col_widths[3] * mm / 2, y_position - 13)
+        draw_text_center_aligned(c, unit, col_positions[3] + col_widths[3] * mm / 2, y_position - 13)
         
         # Unit price (center)
-        draw_text_center_aligned(c, f"{item.unit_price:,.2f}", col_positions[4] + col_widths[4] * mm / 2, y_position - 13)
+        draw_text_center_aligned(c, unit_price, col_positions[4] + col_widths[4] * mm / 2, y_position - 13)
         
         # Total price (center)
-        draw_text_center_aligned(c, f"{item.total_price:,.2f}", col_positions[5] + col_widths[5] * mm / 2, y_position - 13)
+        draw_text_center_aligned(c, total_price, col_positions[5] + col_widths[5] * mm / 2, y_position - 13)
         
         y_position -= row_height
     
     # Handle remaining items if any (continue on next pages)
-    if len(quote_obj.items) > items_per_page:
-        for chunk_start in range(items_per_page, len(quote_obj.items), items_per_page):
+    if len(rows) > items_per_page:
+        for chunk_start in range(items_per_page, len(rows), items_per_page):
             c.showPage()
             c.translate(0, 10*mm)  # 10mm space between pages
             y_position = height - margin_top - 10*mm
             
-            chunk_end = min(chunk_start + items_per_page, len(quote_obj.items))
+            chunk_end = min(chunk_start + items_per_page, len(rows))
             
             # Draw headers
             draw_bordered_box(c, margin_left, y_position, table_width, header_row_height, 
@@ -578,24 +2568,19 @@ async def export_quote_pdf(quote_id: str):
             y_position -= header_row_height
             
             # Draw items for this chunk
-            for i in range(chunk_start, chunk_end):
-                item = quote_obj.items[i]
-                
+            for serial, _, desc, quantity, unit, unit_price, total_price in rows[chunk_start:chunk_end]:
                 # Draw row border
                 for j in range(len(col_widths)):
                     draw_bordered_box(c, col_positions[j], y_position, col_widths[j] * mm, row_height)
                 
                 # Draw data
                 c.setFont("Helvetica", 9)
-                draw_text_center_aligned(c, str(i + 1), col_positions[0] + col_widths[0] * mm / 2, y_position - 13)
-                
-                desc = item.description[:35] + "..." if len(item.description) > 35 else item.description
+                draw_text_center_aligned(c, serial, col_positions[0] + col_widths[0] * mm / 2, y_position - 13)
                 draw_text_right_aligned(c, desc, col_positions[1] + col_widths[1] * mm - 3, y_position - 13)
-                
-                draw_text_center_aligned(c, f"{item.quantity:g}", col_positions[2] + col_widths[2] * mm / 2, y_position - 13)
-                draw_text_center_aligned(c, item.unit, col_positions[3] + col_widths[3] * mm / 2, y_position - 13)
-                draw_text_center_aligned(c, f"{item.unit_price:,.2f}", col_positions[4] + col_widths[4] * mm / 2, y_position - 13)
-                draw_text_center_aligned(c, f"{item.total_price:,.2f}", col_positions[5] + col_widths[5] * mm / 2, y_position - 13)
+                draw_text_center_aligned(c, quantity, col_positions[2] + col_widths[2] * mm / 2, y_position - 13)
+                draw_text_center_aligned(c, unit, col_positions[3] + col_widths[3] * mm / 2, y_position - 13)
+                draw_text_center_aligned(c, unit_price, col_positions[4] + col_widths[4] * mm / 2, y_position - 13)
+                draw_text_center_aligned(c, total_price, col_positions[5] + col_widths[5] * mm / 2, y_position - 13)
                 
                 y_position -= row_height
     
@@ -605,11 +2590,7 @@ async def export_quote_pdf(quote_id: str):
     totals_width = 120 * mm
     totals_x = margin_left + content_width - totals_width
     
-    totals_data = [
-        ("المجموع الفرعي:", f"{quote_obj.subtotal:,.2f} ريال"),
-        ("ضريبة القيمة المضافة (15%):", f"{quote_obj.tax_amount:,.2f} ريال"),
-        ("المبلغ الإجمالي:", f"{quote_obj.total_amount:,.2f} ريال")
-    ]
+    totals_data = model["totals"]
     
     totals_row_height = 20
     
@@ -638,7 +2619,7 @@ async def export_quote_pdf(quote_id: str):
     y_position -= 30
     
     # === NOTES SECTION ===
-    if quote_obj.notes:
+    if model["notes_lines"]:
         c.setFont("Helvetica-Bold", 12)
         draw_text_right_aligned(c, "ملاحظات", margin_left + content_width, y_position)
         y_position -= 25
@@ -649,9 +2630,8 @@ async def export_quote_pdf(quote_id: str):
                          pdf_colors.Color(1, 0.95, 0.8))  # Light yellow
         
         c.setFont("Helvetica", 10)
-        # Wrap notes text
-        notes_lines = textwrap.wrap(quote_obj.notes, width=100)
-        for i, line in enumerate(notes_lines[:4]):  # Max 4 lines
+        # Notes, wrapped to at most 4 lines
+        for i, line in enumerate(model["notes_lines"]):
             draw_text_right_aligned(c, line, margin_left + content_width - 10, y_position - 15 - i*12)
         
         y_position -= 80
@@ -702,36 +2682,22 @@ async def export_quote_pdf(quote_id: str):
     for line in contact_lines:
         draw_text_center_aligned(c, line, margin_left + content_width/2, y_position)
         y_position -= 12
+
+def render_pdf(quote_obj: Quote, company: CompanyInfo) -> bytes:
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4, invariant=1)
+    pin_pdf_metadata(c, pinned_moment(quote_obj), f"{quote_obj.id}:{quote_obj.version}")
+    c.setTitle(f"Quote {quote_obj.quote_number}")
+    draw_pdf_company_header(c, company)
+    draw_pdf_quote(c, quote_obj, company)
+    
+    render_memory.checkpoint()
     
     # Save PDF
     c.save()
-    buffer.seek(0)
-    
-    import time
-    timestamp = int(time.time())
-    headers = {
-        'Content-Disposition': f'attachment; filename="quote_{quote_obj.quote_number}_v{timestamp}.pdf"',
-        'Cache-Control': 'no-cache, no-store, must-revalidate',
-        'Pragma': 'no-cache',
-        'Expires': '0'
-    }
-    
-    return StreamingResponse(
-        BytesIO(buffer.read()),
-        media_type="application/pdf",
-        headers=headers
-    )
+    return buffer.getvalue()
 
-# Word export route - matches preview layout
-@api_router.get("/quotes/{quote_id}/export/word")
-async def export_quote_word(quote_id: str):
-    quote = await db.quotes.find_one({"id": quote_id})
-    if not quote:
-        raise HTTPException(status_code=404, detail="Quote not found")
-    
-    quote_obj = Quote(**quote)
-    company = await get_company_info()
-    
+def render_word(quote_obj: Quote, company: CompanyInfo) -> bytes:
     from docx import Document
     from docx.shared import Inches, Pt, Cm, RGBColor
     from docx.enum.text import WD_ALIGN_PARAGRAPH
@@ -739,6 +2705,8 @@ async def export_quote_word(quote_id: str):
     from docx.oxml.ns import nsdecls
     from docx.oxml import parse_xml
     
+    model = render_model(quote_obj)
+    
     # Create Word document with RTL support
     doc = Document()
     
@@ -775,12 +2743,12 @@ async def export_quote_word(quote_id: str):
     header_table.cell(2, 1).paragraphs[0].runs[0].font.size = Pt(9)
     
     # Quote number and date (right column)
-    header_table.cell(0, 2).text = f'عرض سعر رقم {quote_obj.quote_number}'
+    header_table.cell(0, 2).text = model["title"]
     header_table.cell(0, 2).paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
     header_table.cell(0, 2).paragraphs[0].runs[0].font.size = Pt(12)
     header_table.cell(0, 2).paragraphs[0].runs[0].font.bold = True
     
-    header_table.cell(1, 2).text = f'التاريخ: {quote_obj.created_date.strftime("%B %d, %Y")}'
+    header_table.cell(1, 2).text = f'التاريخ: {model["date"]}'
     header_table.cell(1, 2).paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
     header_table.cell(1, 2).paragraphs[0].runs[0].font.size = Pt(10)
     
@@ -813,20 +2781,7 @@ async def export_quote_word(quote_id: str):
         cell._element.get_or_add_tcPr().append(shading)
     
     # Data rows - matching preview layout exactly
-    company_data = [
-        (f'الشركة: {company.name_ar}', f'العميل: {quote_obj.customer.name}'),
-        (f'الرقم الضريبي: {company.tax_number}', f'الرقم الضريبي: {quote_obj.customer.tax_number or "غير محدد"}'),
-        (f'الشارع: {company.street}', f'الشارع: {quote_obj.customer.street or "غير محدد"}'),
-        (f'الحي: {company.neighborhood}', f'الحي: {quote_obj.customer.neighborhood or "غير محدد"}'),
-        (f'المدينة: {company.city}', f'المدينة: {quote_obj.customer.city or "غير محدد"}'),
-        (f'الدولة: {company.country}', f'الدولة: {quote_obj.customer.country or "غير محدد"}'),
-        (f'السجل التجاري: {company.commercial_registration}', f'السجل التجاري: {quote_obj.customer.commercial_registration or "غير محدد"}'),
-        (f'المبنى: {company.building}', f'المبنى: {quote_obj.customer.building or "غير محدد"}'),
-        (f'الرمز البريدي: {company.postal_code}', f'الرمز البريدي: {quote_obj.customer.postal_code or "غير محدد"}'),
-        (f'الرقم الإضافي: {company.additional_number}', f'الرقم الإضافي: {quote_obj.customer.additional_number or "غير محدد"}'),
-        ('', f'رقم الهاتف: {quote_obj.customer.phone or "غير محدد"}'),
-        ('', '')
-    ]
+    company_data = list(zip(company_lines(company), model["customer_lines"])) + [('', '')]
     
     for i, (company_text, customer_text) in enumerate(company_data, 1):
         info_table.cell(i, 0).text = company_text
@@ -855,7 +2810,7 @@ async def export_quote_word(quote_id: str):
     project_table.cell(0, 0).text = 'وصف المشروع:'
     project_table.cell(0, 1).text = quote_obj.project_description
     project_table.cell(1, 0).text = 'الموقع:'
-    project_table.cell(1, 1).text = quote_obj.location
+    project_table.cell(1, 1).text = model["location"]
     
     # Style project table
     for row in project_table.rows:
@@ -881,7 +2836,8 @@ async def export_quote_word(quote_id: str):
     
     # Calculate if we need page breaks (approximately 20 items per page)
     items_per_page = 20
-    total_items = len(quote_obj.items)
+    rows = item_rows(quote_obj)
+    total_items = len(rows)
     
     if total_items > items_per_page:
         # Split into chunks for page breaks
@@ -912,15 +2868,14 @@ async def export_quote_word(quote_id: str):
                 cell.paragraphs[0].runs[0].font.color.rgb = RGBColor(255, 255, 255)  # White text
             
             # Add items for this chunk
-            for i in range(chunk_start, chunk_end):
-                item = quote_obj.items[i]
+            for serial, description, _, quantity, unit, unit_price, total_price in rows[chunk_start:chunk_end]:
                 row_cells = items_table.add_row().cells
-                row_cells[0].text = str(i + 1)
-                row_cells[1].text = item.description
-                row_cells[2].text = f"{item.quantity:g}"
-                row_cells[3].text = item.unit
-                row_cells[4].text = f"{item.unit_price:,.2f}"
-                row_cells[5].text = f"{item.total_price:,.2f}"
+                row_cells[0].text = serial
+                row_cells[1].text = description
+                row_cells[2].text = quantity
+                row_cells[3].text = unit
+                row_cells[4].text = unit_price
+                row_cells[5].text = total_price
                 
                 # Style data cells
                 row_cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -959,14 +2914,14 @@ async def export_quote_word(quote_id: str):
             cell.paragraphs[0].runs[0].font.color.rgb = RGBColor(255, 255, 255)
         
         # Add all items
-        for i, item in enumerate(quote_obj.items, 1):
+        for serial, description, _, quantity, unit, unit_price, total_price in rows:
             row_cells = items_table.add_row().cells
-            row_cells[0].text = str(i)
-            row_cells[1].text = item.description
-            row_cells[2].text = f"{item.quantity:g}"
-            row_cells[3].text = item.unit
-            row_cells[4].text = f"{item.unit_price:,.2f}"
-            row_cells[5].text = f"{item.total_price:,.2f}"
+            row_cells[0].text = serial
+            row_cells[1].text = description
+            row_cells[2].text = quantity
+            row_cells[3].text = unit
+            row_cells[4].text = unit_price
+            row_cells[5].text = total_price
             
             # Style data cells
             row_cells[0].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
@@ -986,11 +2941,7 @@ async def export_quote_word(quote_id: str):
     totals_table.columns[0].width = Inches(3)
     totals_table.columns[1].width = Inches(2.5)
     
-    totals_data = [
-        ('المجموع الفرعي:', f'{quote_obj.subtotal:,.2f} ريال'),
-        ('ضريبة القيمة المضافة (15%):', f'{quote_obj.tax_amount:,.2f} ريال'),
-        ('المبلغ الإجمالي:', f'{quote_obj.total_amount:,.2f} ريال')
-    ]
+    totals_data = model["totals"]
     
     for i, (desc, amount) in enumerate(totals_data):
         totals_table.cell(i, 0).text = desc
@@ -1068,28 +3019,1252 @@ async def export_quote_word(quote_id: str):
     contact_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
     contact_para.runs[0].font.size = Pt(9)
     
+    render_memory.checkpoint()
+    
+    moment = pinned_moment(quote_obj)
+    doc.core_properties.created = moment
+    doc.core_properties.modified = moment
+    doc.core_properties.revision = quote_obj.version
+    
     # Save document
     buffer = BytesIO()
     doc.save(buffer)
-    buffer.seek(0)
+    return pin_ooxml_package(buffer.getvalue(), moment)
+
+EXPORT_RENDERERS = {
+    "excel": render_excel,
+    "pdf": render_pdf,
+    "word": render_word,
+}
+
+# Export ETags and thumbnail names cover the renderer as well as the quote and the
+# company: RENDERER_VERSION combines the render model version, EXPORT_TEMPLATE_VERSION
+# (bump it when a renderer's layout changes) and the PDF fonts in use
+EXPORT_TEMPLATE_VERSION = 1
+
+def renderer_version() -> str:
+    fonts = hashlib.sha256(b"shaped" if arabic_reshaper else b"unshaped")
+    for font_path in (PDF_ARABIC_FONT, PDF_ARABIC_FONT_BOLD):
+        try:
+            fonts.update(Path(font_path).read_bytes())
+        except OSError:
+            fonts.update(b"missing")
+    return f"{RENDER_MODEL_VERSION}.{EXPORT_TEMPLATE_VERSION}.{fonts.hexdigest()[:8]}"
+
+RENDERER_VERSION = renderer_version()
+
+def export_variant(export_format: str, company_version: str) -> str:
+    return f"{export_format}-{company_version}-{RENDERER_VERSION}"
+
+# Admission control for exports: concurrency caps (global and per format) plus a
+# token bucket per client. Short waits are queued; past the deadline we answer 429.
+# Only requests that render spend a token: 304s, coalesced followers and
+# idempotent replays are free. Behind a reverse proxy (Render, nginx) set
+# TRUST_FORWARDED_FOR to the number of proxies that append to X-Forwarded-For,
+# or every client is keyed on the proxy's address and shares one bucket.
+EXPORT_MAX_CONCURRENCY = int(os.environ.get("EXPORT_MAX_CONCURRENCY", 4))
+EXPORT_FORMAT_CONCURRENCY = os.environ.get("EXPORT_FORMAT_CONCURRENCY", "")  # e.g. "pdf:2,word:2"
+EXPORT_RATE_PER_SECOND = float(os.environ.get("EXPORT_RATE_PER_SECOND", 0.5))  # 0 or less disables per-client rate limiting
+EXPORT_RATE_BURST = float(os.environ.get("EXPORT_RATE_BURST", 10))
+EXPORT_QUEUE_TIMEOUT = float(os.environ.get("EXPORT_QUEUE_TIMEOUT", 5))
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")  # "memory" or "mongo"
+TRUST_FORWARDED_FOR = int(os.environ.get("TRUST_FORWARDED_FOR", 0))  # trusted proxy hops
+
+def parse_format_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        export_format, _, value = part.partition(":")
+        limits[export_format.strip()] = int(value)
+    return limits
+
+def client_key(request: Request) -> str:
+    """Rate-limit identity: the API key when one is sent, the client IP otherwise"""
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if TRUST_FORWARDED_FOR and forwarded_for:
+        # Entries left of those our proxies appended are client-supplied and could be forged
+        addresses = [address.strip() for address in forwarded_for.split(",") if address.strip()]
+        if addresses:
+            return "ip:" + addresses[-min(TRUST_FORWARDED_FOR, len(addresses))]
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+def too_many_requests(retry_after: float, detail: str) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class MemoryTokenBuckets:
+    """Per-process token buckets"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take(self, key: str) -> float:
+        """Take a token; returns 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now)
+            return 0.0
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > 10000:
+            self._prune(now)
+        return (1 - tokens) / self.rate
+
+    def _prune(self, now: float):
+        # Buckets idle long enough to be full again carry no state
+        idle = self.burst / self.rate
+        self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < idle}
+
+class MongoTokenBuckets:
+    """Token buckets shared by all workers, refilled and spent atomically in one update"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+    async def take(self, key: str) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 1000]}
+        refilled = {"$min": [self.burst, {"$add": [{"$ifNull": ["$tokens", self.burst]}, {"$multiply": [elapsed, self.rate]}]}]}
+        bucket = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {"granted": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires": now,
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["granted"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / self.rate
+
+class AdmissionController:
+    def __init__(self):
+        self.global_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENCY)
+        self.format_limits = parse_format_limits(EXPORT_FORMAT_CONCURRENCY)
+        self.format_slots: Dict[str, asyncio.Semaphore] = {}
+        bucket_class = MongoTokenBuckets if RATE_LIMIT_BACKEND == "mongo" else MemoryTokenBuckets
+        self.buckets = bucket_class(EXPORT_RATE_PER_SECOND, EXPORT_RATE_BURST) if EXPORT_RATE_PER_SECOND > 0 else None
+        self.queued = 0
+        self.rejected = 0
+
+    async def check_rate(self, key: str):
+        """Spend one token for this client, waiting up to EXPORT_QUEUE_TIMEOUT for the bucket to refill"""
+        if self.buckets is None:
+            return
+        deadline = time.monotonic() + EXPORT_QUEUE_TIMEOUT
+        queued = False
+        while True:
+            wait = await self.buckets.take(key)
+            if wait == 0:
+                return
+            # Concurrent waiters on one bucket race for each refilled token, so keep waiting until the deadline
+            if time.monotonic() + wait > deadline:
+                self.rejected += 1
+                raise too_many_requests(wait, "Export rate limit exceeded")
+            if not queued:
+                self.queued += 1
+                queued = True
+            await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def slot(self, export_format: str):
+        """Hold a render slot for this format and globally, queueing up to EXPORT_QUEUE_TIMEOUT"""
+        if export_format not in self.format_slots:
+            self.format_slots[export_format] = asyncio.Semaphore(self.format_limits.get(export_format, EXPORT_MAX_CONCURRENCY))
+        format_slots = self.format_slots[export_format]
+        deadline = time.monotonic() + EXPORT_QUEUE_TIMEOUT
+        acquired = []
+        try:
+            # Narrow (per-format) semaphore first so we never sit on a global slot while waiting
+            for semaphore in (format_slots, self.global_slots):
+                if semaphore.locked():
+                    self.queued += 1
+                try:
+                    await asyncio.wait_for(semaphore.acquire(), timeout=max(0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise too_many_requests(1, "Export capacity exhausted, retry shortly")
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "global_available": self.global_slots._value,
+            "format_available": {fmt: sem._value for fmt, sem in self.format_slots.items()},
+        }
+
+export_admission = AdmissionController()
+
+class ExportCoalescer:
+    """Concurrent requests for the same export share a single render"""
+
+    def __init__(self):
+        self.inflight: Dict[Tuple[str, ...], asyncio.Future] = {}
+        self.renders = 0
+        self.coalesced = 0
+
+    async def render(self, key: Tuple[str, ...], render) -> bytes:
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(render())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+            self.renders += 1
+        else:
+            self.coalesced += 1
+        # Shielded so one client disconnecting does not cancel the render the others await
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {"renders": self.renders, "coalesced": self.coalesced, "in_flight": len(self.inflight)}
+
+export_coalescer = ExportCoalescer()
+
+async def render_export(request: Request, export_format: str, quote: Dict[str, Any], quote_obj: Quote, company: CompanyInfo, variant: str) -> bytes:
+    # Same quote revision + same company data + same format => same bytes
+    key = (quote_obj.id, str(quote_obj.version), validator_timestamp(quote.get("updated_date")), variant)
+    if key not in export_coalescer.inflight:
+        await export_admission.check_rate(client_key(request))
+    started = time.perf_counter()
+    try:
+        return await export_coalescer.render(key, lambda: admitted_render(export_format, quote_obj, company))
+    finally:
+        add_render_time(started)
+
+def add_render_time(started: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings["render_ms"] += (time.perf_counter() - started) * 1000
+
+async def admitted_render(export_format: str, quote_obj: Quote, company: CompanyInfo) -> bytes:
+    renderer = EXPORT_RENDERERS[export_format]
+    async with export_admission.slot(export_format):
+        if EXPORT_MEMORY_TRACKING:
+            return await run_in_threadpool(render_memory.measure, export_format, renderer, quote_obj, company)
+        return await run_in_threadpool(renderer, quote_obj, company)
+
+# Export routes
+@api_router.get("/quotes/{quote_id}/export/excel")
+@idempotent("export_quote_excel")
+async def export_quote_excel(quote_id: str, request: Request, tenant_id: str = Depends(current_tenant)):
+    company, company_version = await company_cache.get(tenant_id)
+    variant = export_variant("excel", company_version)
+    not_modified = await quote_not_modified(request, tenant_id, quote_id, variant)
+    if not_modified:
+        return not_modified
+    
+    quote = await find_quote(tenant_id, quote_id, database=read_db)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    
+    quote_obj = await quote_for_export(quote)
+    
+    content = await render_export(request, "excel", quote, quote_obj, company, variant)
     
-    timestamp = int(time.time())
     headers = {
-        'Content-Disposition': f'attachment; filename="quote_{quote_obj.quote_number}_v{timestamp}.docx"',
-        'Cache-Control': 'no-cache, no-store, must-revalidate',
-        'Pragma': 'no-cache',
-        'Expires': '0'
+        'Content-Disposition': f'attachment; filename="quote_{quote_obj.quote_number}.xlsx"',
+        'ETag': quote_etag(quote, variant),
+        'Cache-Control': CONDITIONAL_CACHE_CONTROL
     }
     
-    return StreamingResponse(
-        BytesIO(buffer.read()),
+    return Response(
+        content=content,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=headers
+    )
+
+@api_router.get("/quotes/{quote_id}/export/pdf")
+@idempotent("export_quote_pdf")
+async def export_quote_pdf(quote_id: str, request: Request, tenant_id: str = Depends(current_tenant)):
+    company, company_version = await company_cache.get(tenant_id)
+    variant = export_variant("pdf", company_version)
+    not_modified = await quote_not_modified(request, tenant_id, quote_id, variant)
+    if not_modified:
+        return not_modified
+    
+    quote = await find_quote(tenant_id, quote_id, database=read_db)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    
+    quote_obj = await quote_for_export(quote)
+    
+    content = await render_export(request, "pdf", quote, quote_obj, company, variant)
+    
+    headers = {
+        'Content-Disposition': f'attachment; filename="quote_{quote_obj.quote_number}.pdf"',
+        'ETag': quote_etag(quote, variant),
+        'Cache-Control': CONDITIONAL_CACHE_CONTROL
+    }
+    
+    return Response(
+        content=content,
+        media_type="application/pdf",
+        headers=headers
+    )
+
+# Word export route - matches preview layout
+@api_router.get("/quotes/{quote_id}/export/word")
+@idempotent("export_quote_word")
+async def export_quote_word(quote_id: str, request: Request, tenant_id: str = Depends(current_tenant)):
+    company, company_version = await company_cache.get(tenant_id)
+    variant = export_variant("word", company_version)
+    not_modified = await quote_not_modified(request, tenant_id, quote_id, variant)
+    if not_modified:
+        return not_modified
+    
+    quote = await find_quote(tenant_id, quote_id, database=read_db)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    
+    quote_obj = await quote_for_export(quote)
+    
+    content = await render_export(request, "word", quote, quote_obj, company, variant)
+    
+    headers = {
+        'Content-Disposition': f'attachment; filename="quote_{quote_obj.quote_number}.docx"',
+        'ETag': quote_etag(quote, variant),
+        'Cache-Control': CONDITIONAL_CACHE_CONTROL
+    }
+    
+    return Response(
+        content=content,
         media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
         headers=headers
     )
 
+# Merged PDF export: many quotes drawn through one canvas, with a bookmark per
+# quote. Quotes come off a cursor and are drawn one at a time, so only finished
+# (compressed) pages accumulate; the company header form and logo are shared.
+# ReportLab holds every page until the document is saved, so memory still grows
+# with the batch: MERGED_EXPORT_MAX_QUOTES bounds it (requests matching more are
+# rejected with 400). The saved document goes to a temporary file once past
+# MERGED_EXPORT_SPOOL_SIZE and is streamed from there in chunks.
+MERGED_EXPORT_MAX_QUOTES = int(os.environ.get("MERGED_EXPORT_MAX_QUOTES", 500))
+MERGED_EXPORT_BATCH_SIZE = 50
+MERGED_EXPORT_SPOOL_SIZE = 4 * 1024 * 1024
+
+class MergedPdf:
+    def __init__(self, company: CompanyInfo):
+        self.company = company
+        self.output = tempfile.SpooledTemporaryFile(max_size=MERGED_EXPORT_SPOOL_SIZE)
+        self.canvas = canvas.Canvas(self.output, pagesize=A4, invariant=1)
+        self.count = 0
+        self.latest = None
+        self.fingerprint = hashlib.sha256()
+        draw_pdf_company_header(self.canvas, company)
+
+    def add(self, quote_obj: Quote):
+        c = self.canvas
+        if self.count:
+            c.showPage()
+        key = f"quote-{self.count}"
+        c.bookmarkPage(key)
+        c.addOutlineEntry(f"{quote_obj.quote_number} - {quote_obj.customer.name}", key, level=0)
+        draw_pdf_quote(c, quote_obj, self.company)
+        self.count += 1
+        moment = pinned_moment(quote_obj)
+        self.latest = max(self.latest or moment, moment)
+        self.fingerprint.update(f"{quote_obj.id}:{quote_obj.version};".encode())
+
+    def finish(self) -> int:
+        """Saves the document and returns its size; read it with chunks()"""
+        # Dated like the most recently updated quote it contains
+        pin_pdf_metadata(self.canvas, self.latest, self.fingerprint.hexdigest())
+        self.canvas.showOutline()
+        self.canvas.save()
+        size = self.output.tell()
+        self.output.seek(0)
+        return size
+
+    def chunks(self):
+        try:
+            while chunk := self.output.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            self.output.close()
+
+@api_router.get("/quotes/export/pdf")
+@idempotent("export_quotes_pdf")
+async def export_quotes_pdf(
+    request: Request,
+    customer: Optional[str] = None,
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    tenant_id: str = Depends(current_tenant),
+):
+    """All quotes for a customer (name or tax number) and/or created_date range, oldest first, as one PDF"""
+    query = {"tenant_id": tenant_id, **created_range_query(date_from, date_to)}
+    if customer:
+        query["$or"] = [{"customer.name": customer}, {"customer.tax_number": customer}]
+    archived_total = await read_db.archived_quotes.count_documents(query)
+    total = archived_total + await read_db.quotes.count_documents(query)
+    if not total:
+        raise HTTPException(status_code=404, detail="No quotes match the filter")
+    if total > MERGED_EXPORT_MAX_QUOTES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{total} quotes match the filter; narrow it to at most {MERGED_EXPORT_MAX_QUOTES}",
+        )
+    await export_admission.check_rate(client_key(request))
+
+    company, _ = await company_cache.get(tenant_id)
+    started = time.perf_counter()
+    async with export_admission.slot("pdf"):
+        merged = await run_in_threadpool(MergedPdf, company)
+        # Archival goes by updated_date, so hot and archived quotes interleave by created_date
+        hot = read_db.quotes.find(query, QUOTE_RENDER_PROJECTION).sort("created_date", 1).batch_size(MERGED_EXPORT_BATCH_SIZE)
+        sources = [aiter(hot)]
+        if archived_total:
+            cursor = read_db.archived_quotes.find(query, archive_projection(QUOTE_RENDER_PROJECTION))
+            cursor = cursor.sort("created_date", 1).batch_size(MERGED_EXPORT_BATCH_SIZE)
+            sources.append(thaw_quote(quote) async for quote in cursor)
+        async for quote in merge_by_created_date(*sources):
+            await run_in_threadpool(merged.add, quote_for_render(quote))
+        size = await run_in_threadpool(merged.finish)
+    add_render_time(started)
+
+    period = "_".join(value.strftime("%Y%m%d") for value in (date_from, date_to) if value)
+    headers = {
+        'Content-Disposition': f'attachment; filename="quotes{"_" + period if period else ""}.pdf"',
+        'Content-Length': str(size),
+    }
+    return StreamingResponse(merged.chunks(), media_type="application/pdf", headers=headers)
+
+# Quote thumbnails: page 1 of the PDF rasterized with PDFium (bundled with
+# pypdfium2, no system libraries). Files are named by a hash of everything the
+# image depends on and kept on disk, shared by all workers, up to a size budget.
+THUMBNAIL_DIR = ROOT_DIR / "thumbnails"
+THUMBNAIL_CACHE_BYTES = int(os.environ.get("THUMBNAIL_CACHE_BYTES", 64 * 1024 * 1024))
+THUMBNAIL_WIDTHS = (120, 240, 480)
+THUMBNAIL_DEFAULT_WIDTH = 240
+THUMBNAIL_MEDIA_TYPES = {"webp": "image/webp", "png": "image/png"}
+THUMBNAIL_DEFAULT_FORMAT = "webp"
+
+# PDFium is not thread-safe
+pdfium_lock = threading.Lock()
+
+def render_thumbnail(quote_obj: Quote, company: CompanyInfo, width: int, image_format: str) -> bytes:
+    pdf_bytes = render_pdf(quote_obj, company)
+    with pdfium_lock:
+        document = pdfium.PdfDocument(pdf_bytes)
+        try:
+            page = document[0]
+            image = page.render(scale=width / page.get_width()).to_pil()
+        finally:
+            document.close()
+    output = BytesIO()
+    if image_format == "webp":
+        image.save(output, format="WEBP", quality=80, method=4)
+    else:
+        image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+thumbnail_cache = FileCache(THUMBNAIL_DIR, THUMBNAIL_CACHE_BYTES)
+background_tasks = set()
+
+def thumbnail_variant(width: int, image_format: str, company_version: str) -> str:
+    return f"thumb-{width}-{image_format}-{company_version}-{RENDERER_VERSION}"
+
+def thumbnail_version(quote: Dict[str, Any], company_version: str) -> str:
+    """The ?v= value of an immutable thumbnail URL: the image changes with the quote,
+    with the company (logo, names) and with the renderer"""
+    return f"{quote.get('version') or 1}.{company_version}.{RENDERER_VERSION}"
+
+async def get_thumbnail(quote: Dict[str, Any], company: CompanyInfo, width: int, image_format: str, variant: str) -> bytes:
+    name = hashlib.sha256(quote_etag(quote, variant).encode()).hexdigest() + "." + image_format
+    cached = await run_in_threadpool(thumbnail_cache.get, name)
+    if cached is not None:
+        return cached
+    quote_obj = quote_for_render(quote)
+    started = time.perf_counter()
+    try:
+        async with export_admission.slot("thumbnail"):
+            data = await run_in_threadpool(render_thumbnail, quote_obj, company, width, image_format)
+    finally:
+        add_render_time(started)
+    await run_in_threadpool(thumbnail_cache.put, name, data)
+    return data
+
+async def refresh_thumbnail(tenant_id: str, quote_id: str):
+    """Renders the default thumbnail of a quote's new revision ahead of the next list view"""
+    try:
+        quote = await db.quotes.find_one({"tenant_id": tenant_id, "id": quote_id}, QUOTE_RENDER_PROJECTION)
+        if quote:
+            company, company_version = await company_cache.get(tenant_id)
+            variant = thumbnail_variant(THUMBNAIL_DEFAULT_WIDTH, THUMBNAIL_DEFAULT_FORMAT, company_version)
+            await get_thumbnail(quote, company, THUMBNAIL_DEFAULT_WIDTH, THUMBNAIL_DEFAULT_FORMAT, variant)
+    except HTTPException:
+        pass  # export capacity is saturated; the thumbnail will be rendered on demand
+    except Exception:
+        logger.exception("Thumbnail refresh failed for quote %s", quote_id)
+
+def schedule_thumbnail_refresh(tenant_id: str, quote_id: str):
+    if pdfium is None:
+        return
+    task = asyncio.create_task(refresh_thumbnail(tenant_id, quote_id))
+    # Keep a reference until it finishes so the task is not garbage collected
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@api_router.get("/quotes/{quote_id}/thumbnail")
+async def get_quote_thumbnail(
+    quote_id: str,
+    request: Request,
+    width: int = THUMBNAIL_DEFAULT_WIDTH,
+    image_format: str = Query(THUMBNAIL_DEFAULT_FORMAT, alias="format"),
+    v: Optional[str] = None,
+    tenant_id: str = Depends(current_tenant),
+):
+    """Page 1 preview. Content-Location names the versioned URL of this image, which is
+    cached as immutable; a new quote revision or company change gives a new one."""
+    if pdfium is None:
+        raise HTTPException(status_code=503, detail="Thumbnail rendering is not available")
+    if width not in THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"width must be one of {', '.join(map(str, THUMBNAIL_WIDTHS))}")
+    if image_format not in THUMBNAIL_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be webp or png")
+
+    company, company_version = await company_cache.get(tenant_id)
+    variant = thumbnail_variant(width, image_format, company_version)
+    not_modified = await quote_not_modified(request, tenant_id, quote_id, variant)
+    if not_modified:
+        return not_modified
+
+    quote = await find_quote(tenant_id, quote_id, QUOTE_RENDER_PROJECTION, database=read_db)
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    content = await get_thumbnail(quote, company, width, image_format, variant)
+
+    version = thumbnail_version(quote, company_version)
+    headers = {
+        'ETag': quote_etag(quote, variant),
+        # A versioned URL never changes meaning; an unversioned one must revalidate
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if v == version else CONDITIONAL_CACHE_CONTROL,
+        'Content-Location': f"{request.url.path}?{urlencode({'width': width, 'format': image_format, 'v': version})}",
+    }
+    return Response(content=content, media_type=THUMBNAIL_MEDIA_TYPES[image_format], headers=headers)
+
+# On-demand profiling. A sampling thread records folded stacks of all threads
+# (event loop and render threadpool) while profiled requests are in flight; the
+# profile is kept if the request was slow or explicitly asked for one. Event
+# streams are never profiled: they stay open indefinitely, so the sampler would
+# run for as long as a client listens and leak into every other profile.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+PROFILE_SLOW_REQUEST_MS = float(os.environ.get("PROFILE_SLOW_REQUEST_MS", 0))  # 0 disables threshold capture
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 20))
+PROFILING_ENABLED = PROFILE_SLOW_REQUEST_MS > 0 or ADMIN_TOKEN is not None
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get")}
+
+def is_admin_token(value: Optional[str]) -> bool:
+    return ADMIN_TOKEN is not None and value is not None and hmac.compare_digest(value.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin_token(request.headers.get("x-admin-token")):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def folded_stack(frame) -> Optional[str]:
+    """Render a frame as a flame-graph "folded" stack (root first), or None if the thread is idle"""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """Samples every thread's stack into the Counters of the requests currently being profiled"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active: Dict[int, collections.Counter] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, token: int) -> collections.Counter:
+        samples = collections.Counter()
+        with self._lock:
+            self.active[token] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return samples
+
+    def stop(self, token: int) -> collections.Counter:
+        with self._lock:
+            return self.active.pop(token, collections.Counter())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while True:
+            with self._lock:
+                targets = list(self.active.values())
+            if not targets:
+                # Nothing to profile: park until the next profiled request
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = folded_stack(frame)
+                if stack:
+                    stack = f"{names.get(thread_id, thread_id)};{stack}"
+                    for samples in targets:
+                        samples[stack] += 1
+            time.sleep(self.interval)
+
+class ProfilingMiddleware:
+    """Keeps the most recent profiles of slow requests and of requests sent with X-Profile: <admin token>"""
+
+    def __init__(self, app):
+        self.app = app
+        self._next_token = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        forced = is_admin_token(headers.get("x-profile"))
+        if (not forced and PROFILE_SLOW_REQUEST_MS <= 0) or "text/event-stream" in headers.get("accept", ""):
+            await self.app(scope, receive, send)
+            return
+
+        self._next_token += 1
+        token = self._next_token
+        status = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if Headers(raw=message["headers"]).get("content-type", "").startswith("text/event-stream"):
+                    # Streams whose client did not ask for one in Accept: stop sampling now and keep nothing
+                    status["streaming"] = True
+                    stack_sampler.stop(token)
+            await send(message)
+
+        started = time.perf_counter()
+        stack_sampler.start(token)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            samples = stack_sampler.stop(token)
+            duration_ms = (time.perf_counter() - started) * 1000
+            if not status.get("streaming") and (forced or duration_ms >= PROFILE_SLOW_REQUEST_MS):
+                recent_profiles.append({
+                    "id": uuid.uuid4().hex[:12],
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status.get("code"),
+                    "duration_ms": round(duration_ms, 1),
+                    "started": datetime.now(timezone.utc),
+                    "forced": forced,
+                    "samples": samples,
+                })
+
+stack_sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+recent_profiles = collections.deque(maxlen=PROFILE_KEEP)
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return [
+        {k: v for k, v in profile.items() if k != "samples"} | {"sample_count": sum(profile["samples"].values())}
+        for profile in reversed(recent_profiles)
+    ]
+
+@api_router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Folded stacks ("stack;frames count" per line) for flamegraph.pl, speedscope or inferno"""
+    for profile in recent_profiles:
+        if profile["id"] == profile_id:
+            lines = [f"{stack} {count}" for stack, count in profile["samples"].most_common()]
+            return Response(content="\n".join(lines) + "\n", media_type="text/plain")
+    raise HTTPException(status_code=404, detail="Profile not found")
+
+@api_router.post("/admin/archive", dependencies=[Depends(require_admin)])
+async def archive_old_quotes(older_than_days: int = Query(ARCHIVE_AFTER_DAYS or 730, ge=1)):
+    """Runs the archival job now"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    return {"archived": await archive_quotes(cutoff), "cutoff": cutoff}
+
+# Dump and restore: all companies and quotes (hot and archived) as gzip NDJSON,
+# or one collection as gzip CSV. Dumps stream from cursors in compressed chunks
+# and restores insert in batches, so memory stays flat however large the data
+# is. backup.py runs the same code from the command line.
+DUMP_FORMATS = ("ndjson", "csv")
+DUMP_COLLECTIONS = ("companies", "quotes")
+DUMP_BATCH_SIZE = 500
+DUMP_CHUNK_SIZE = 256 * 1024
+DUMP_COMPRESSION_LEVEL = int(os.environ.get("DUMP_COMPRESSION_LEVEL", 6))
+RESTORE_BATCH_SIZE = int(os.environ.get("RESTORE_BATCH_SIZE", 500))
+GZIP_WBITS = 31  # zlib stream with a gzip header and trailer
+
+QUOTE_CSV_FIELDS = [name for name in Quote.model_fields if name not in ("customer", "items")]
+
+def dump_collections(export_format: str, collection: Optional[str]) -> Tuple[str, ...]:
+    if export_format not in DUMP_FORMATS:
+        raise ValueError("format must be ndjson or csv")
+    if collection is None:
+        # A CSV file holds one table
+        return DUMP_COLLECTIONS if export_format == "ndjson" else ("quotes",)
+    if collection not in DUMP_COLLECTIONS:
+        raise ValueError("collection must be companies or quotes")
+    return (collection,)
+
+def csv_columns(collection: str) -> List[str]:
+    if collection == "companies":
+        return ["tenant_id", *CompanyInfo.model_fields, "updated_date"]
+    return [
+        "tenant_id",
+        *QUOTE_CSV_FIELDS,
+        *(f"customer.{name}" for name in CustomerInfo.model_fields),
+        *(f"item.{name}" for name in QuoteItem.model_fields),
+    ]
+
+def csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return as_utc(value).isoformat()
+    return value
+
+def csv_rows(collection: str, document: Dict[str, Any]) -> List[List[Any]]:
+    """One row per company, or one row per quote item with the quote's own fields repeated"""
+    if collection == "companies":
+        return [[csv_value(document.get(column)) for column in csv_columns(collection)]]
+    head = [csv_value(document.get(name)) for name in ("tenant_id", *QUOTE_CSV_FIELDS)]
+    customer = document.get("customer") or {}
+    head += [csv_value(customer.get(name)) for name in CustomerInfo.model_fields]
+    return [head + [csv_value(item.get(name)) for name in QuoteItem.model_fields] for item in document.get("items") or [{}]]
+
+async def dump_documents(collection: str, tenant_id: Optional[str]):
+    query = {"tenant_id": tenant_id} if tenant_id else {}
+    if collection == "companies":
+        async for company in read_db.companies.find(query, {"_id": 0}):
+            yield company
+        return
+    async for quote in read_db.quotes.find(query, {"_id": 0, "render_model": 0}).batch_size(DUMP_BATCH_SIZE):
+        yield unpack_items(quote)
+    async for quote in read_db.archived_quotes.find(query, {"_id": 0}).batch_size(DUMP_BATCH_SIZE):
+        yield thaw_quote(quote)
+
+async def dump_stream(export_format: str, collections: Tuple[str, ...], tenant_id: Optional[str] = None):
+    """Gzip chunks of a dump; NDJSON lines are {"collection": ..., "document": ...}"""
+    compressor = zlib.compressobj(DUMP_COMPRESSION_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    text = StringIO()
+    writer = csv.writer(text)
+    pending, pending_size = [], 0
+    for collection in collections:
+        if export_format == "csv":
+            writer.writerow(csv_columns(collection))
+        async for document in dump_documents(collection, tenant_id):
+            if export_format == "csv":
+                writer.writerows(csv_rows(collection, document))
+                data = text.getvalue().encode()
+                text.seek(0)
+                text.truncate()
+            else:
+                data = orjson.dumps(
+                    {"collection": collection, "document": document},
+                    option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_APPEND_NEWLINE,
+                )
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= DUMP_CHUNK_SIZE:
+                chunk = await run_in_threadpool(compressor.compress, b"".join(pending))
+                pending, pending_size = [], 0
+                if chunk:
+                    yield chunk
+    pending.append(text.getvalue().encode())
+    yield compressor.compress(b"".join(pending)) + compressor.flush()
+
+async def gunzip_lines(chunks):
+    """Text lines, with their newline, of a gzip byte stream"""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    rest = ""
+    async for chunk in chunks:
+        *lines, rest = (rest + decoder.decode(decompressor.decompress(chunk))).split("\n")
+        for line in lines:
+            yield line + "\n"
+    if not decompressor.eof:
+        raise ValueError("gzip stream is truncated")
+    if rest:
+        yield rest
+
+async def ndjson_records(lines):
+    async for line in lines:
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        if not isinstance(record, dict) or record.get("collection") not in DUMP_COLLECTIONS:
+            raise ValueError("every line must be a {collection, document} record")
+        yield record["collection"], record["document"]
+
+async def csv_records(lines, collection: str):
+    """Documents from dump CSV; the item rows of a quote are consecutive"""
+    columns = None
+    quote = None
+    pending = ""
+    async for line in lines:
+        # A quoted field may span lines: a record ends where its quotes balance
+        pending += line
+        if pending.count('"') % 2:
+            continue
+        row, pending = next(csv.reader([pending])), ""
+        if columns is None:
+            columns = row
+            continue
+        fields = {column: value for column, value in zip(columns, row) if value != ""}
+        if collection == "companies":
+            yield collection, fields
+            continue
+        if quote is not None and (quote.get("tenant_id"), quote.get("id")) != (fields.get("tenant_id"), fields.get("id")):
+            yield collection, quote
+            quote = None
+        if quote is None:
+            quote = {name: value for name, value in fields.items() if "." not in name}
+            quote["customer"] = {name[9:]: value for name, value in fields.items() if name.startswith("customer.")}
+            quote["items"] = []
+        item = {name[5:]: value for name, value in fields.items() if name.startswith("item.")}
+        if item:
+            quote["items"].append(item)
+    if quote is not None:
+        yield collection, quote
+
+def restored_quote(tenant_id: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    quote_obj = Quote(**document)
+    quote = quote_obj.model_dump()
+    quote["tenant_id"] = tenant_id
+    quote["render_model"] = build_render_model(quote_obj)
+    return pack_large_items(quote)
+
+async def restore_quotes(batch: List[Tuple[str, Dict[str, Any]]], counts: Dict[str, int]):
+    """Inserts a batch of dumped quotes, skipping those already present (hot or archived)"""
+    quotes = await run_in_threadpool(lambda: [restored_quote(tenant_id, document) for tenant_id, document in batch])
+    query = {"tenant_id": {"$in": list({quote["tenant_id"] for quote in quotes})}, "id": {"$in": [quote["id"] for quote in quotes]}}
+    present = {quote["id"] async for quote in db.quotes.find(query, {"id": 1})}
+    present |= {quote["id"] async for quote in db.archived_quotes.find(query, {"id": 1})}
+    quotes = [quote for quote in quotes if quote["id"] not in present]
+    counts["skipped"] += len(batch) - len(quotes)
+    if not quotes:
+        return
+    # The current version becomes the start of each restored quote's history
+    revisions = [
+        {
+            "quote_id": quote["id"],
+            "version": quote["version"],
+            "created_date": quote["updated_date"],
+            "changed_fields": [],
+            "kind": "snapshot",
+            "snapshot": revision_payload(quote),
+        }
+        for quote in quotes
+    ]
+    await db.quotes.insert_many(quotes, ordered=False)
+    try:
+        await db.quote_revisions.insert_many(revisions, ordered=False)
+    except BulkWriteError as exc:
+        if not only_duplicate_keys(exc):
+            raise
+    counts["quotes"] += len(quotes)
+
+async def restore_records(records) -> Dict[str, int]:
+    """Companies replace the tenant's current one; quotes are added in batches"""
+    counts = {"companies": 0, "quotes": 0, "skipped": 0}
+    tenants = set()
+    batch = []
+    async for collection, document in records:
+        tenant_id = document.pop("tenant_id", None) or DEFAULT_TENANT_ID
+        if collection == "companies":
+            company = CompanyInfo(**document).dict()
+            updated_date = document.get("updated_date")
+            if updated_date:
+                company["updated_date"] = updated_date if isinstance(updated_date, datetime) else parse_stored_date(updated_date)
+            await db.companies.replace_one({"tenant_id": tenant_id}, {"tenant_id": tenant_id, **company}, upsert=True)
+            company_cache.invalidate(tenant_id)
+            counts["companies"] += 1
+            continue
+        tenants.add(tenant_id)
+        batch.append((tenant_id, document))
+        if len(batch) >= RESTORE_BATCH_SIZE:
+            await restore_quotes(batch, counts)
+            batch = []
+    if batch:
+        await restore_quotes(batch, counts)
+    for tenant_id in tenants:
+        # New quotes must number after the restored ones
+        await seed_quote_counter(tenant_id)
+    return counts
+
+async def restore_stream(chunks, export_format: str, collection: Optional[str] = None) -> Dict[str, int]:
+    """Restores a dump from an async iterable of gzip chunks"""
+    lines = gunzip_lines(chunks)
+    if export_format == "csv":
+        return await restore_records(csv_records(lines, collection or "quotes"))
+    return await restore_records(ndjson_records(lines))
+
+@api_router.get("/admin/dump", dependencies=[Depends(require_admin)])
+async def dump_data(
+    export_format: str = Query("ndjson", alias="format"),
+    collection: Optional[str] = None,
+    tenant: Optional[str] = None,
+):
+    """Gzip NDJSON of every company and quote, or gzip CSV of one collection; optionally one tenant only"""
+    try:
+        collections = dump_collections(export_format, collection)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    filename = f"{'-'.join(collections)}{'-' + tenant if tenant else ''}.{export_format}.gz"
+    return StreamingResponse(
+        dump_stream(export_format, collections, tenant),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@api_router.post("/admin/restore", dependencies=[Depends(require_admin)])
+async def restore_data(
+    request: Request,
+    export_format: str = Query("ndjson", alias="format"),
+    collection: Optional[str] = None,
+):
+    """Loads a file made by /admin/dump, sent as the raw request body. Quotes that already exist are skipped,
+    so a restore that failed part way can simply be repeated."""
+    try:
+        collections = dump_collections(export_format, collection)
+        return await restore_stream(request.stream(), export_format, collections[0])
+    except (ValueError, zlib.error) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid dump: {exc}")
+
+# Logging: handlers on the loop only enqueue records; a listener thread formats
+# them as JSON lines and does the actual write
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # "json" or "text"
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return orjson.dumps(entry, default=str).decode()
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id while still in the thread that logged"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args into the message now since they may change after the call;
+        # the queue never leaves the process, so exc_info is kept for the
+        # listener to format instead of being rendered here
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def configure_logging():
+    output = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonLogFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    handler = LogQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    # Route uvicorn's loggers through the queue too; its access log is replaced
+    # by the one RequestContextMiddleware writes
+    for name in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    # Drains whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+access_logger = logging.getLogger("access")
+
+class RequestContextMiddleware:
+    """Assigns a request id (or keeps a sane incoming X-Request-ID), echoes it on
+    the response and writes one access-log line per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+        timings = {"db_ms": 0.0, "db_ops": 0, "render_ms": 0.0}
+        id_token = request_id_var.set(request_id)
+        timings_token = request_timings.set(timings)
+        response = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            duration_ms = (time.perf_counter() - started) * 1000
+            access_logger.info(
+                "%s %s %s", scope["method"], route or scope["path"], response["status"],
+                extra={"fields": {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route,
+                    "status": response["status"],
+                    "bytes": response["bytes"],
+                    "duration_ms": round(duration_ms, 2),
+                    "db_ms": round(timings["db_ms"], 2),
+                    "db_ops": timings["db_ops"],
+                    "render_ms": round(timings["render_ms"], 2),
+                }},
+            )
+            request_id_var.reset(id_token)
+            request_timings.reset(timings_token)
+
+# Response compression: JSON, NDJSON, CSV and text bodies are compressed with the
+# best encoding the client accepts (brotli, zstd, gzip, as installed). Formats
+# that are already compressed (xlsx, docx, pdf, images, gzip dumps) and event
+# streams are not on the allow-list. Large bodies compress in the threadpool.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_OFFLOAD_SIZE = int(os.environ.get("COMPRESSION_OFFLOAD_SIZE", 64 * 1024))
+COMPRESSION_TYPES = set(os.environ.get(
+    "COMPRESSION_TYPES",
+    "application/json,application/x-ndjson,text/csv,text/plain,text/html,text/css,application/javascript,image/svg+xml",
+).split(","))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))  # 11 is far too slow per request
+ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", 3))
+
+def gzip_encoder():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress, compressor.flush
+
+def brotli_encoder():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return compressor.process, compressor.finish
+
+def zstd_encoder():
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return compressor.compress, compressor.flush
+
+# In order of preference; each encoder is a (compress, finish) pair
+RESPONSE_ENCODERS = {
+    name: encoder
+    for name, encoder, available in (("br", brotli_encoder, brotli), ("zstd", zstd_encoder, zstandard), ("gzip", gzip_encoder, True))
+    if available
+}
+compression_stats = collections.Counter()
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in RESPONSE_ENCODERS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def encode_body(encoding: str, body: bytes) -> bytes:
+    compress, finish = RESPONSE_ENCODERS[encoding]()
+    return compress(body) + finish()
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder = None  # set while a streamed body is being compressed
+
+        async def send_wrapper(message):
+            nonlocal start, encoder
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is None:
+                # Body of a response already passed through or being streamed compressed
+                if encoder is not None:
+                    compress, finish = encoder
+                    body = await self.run(compress, body)
+                    if not more_body:
+                        body += finish()
+                    compression_stats["bytes_out"] += len(body)
+                    message = {**message, "body": body}
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            content_length = headers.get("content-length")
+            size = len(body) if not more_body else int(content_length) if content_length else None
+            if not self.compressible(start["status"], headers) or (size is not None and size < COMPRESSION_MIN_SIZE):
+                await send(start)
+                start = None
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # The compressed bytes differ from the identity representation
+                headers["ETag"] = f"W/{etag}"
+            for name in ("content-length", "accept-ranges"):
+                if name in headers:
+                    del headers[name]
+            compression_stats[encoding] += 1
+            compression_stats["bytes_in"] += len(body) if size is None else size
+            if more_body:
+                encoder = RESPONSE_ENCODERS[encoding]()
+                body = await self.run(encoder[0], body)
+            else:
+                body = await self.run(functools.partial(encode_body, encoding), body)
+                headers["Content-Length"] = str(len(body))
+            compression_stats["bytes_out"] += len(body)
+            await send(start)
+            start = None
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def compressible(status: int, headers: MutableHeaders) -> bool:
+        if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+            return False
+        return headers.get("content-type", "").split(";")[0].strip() in COMPRESSION_TYPES
+
+    @staticmethod
+    async def run(fn, data: bytes) -> bytes:
+        if len(data) >= COMPRESSION_OFFLOAD_SIZE:
+            return await run_in_threadpool(fn, data)
+        return fn(data)
+
+# Health: readiness for load balancers and orchestrators
+@api_router.get("/health")
+async def health():
+    """200 while MongoDB answers a ping, 503 otherwise; with connection pool and command latency stats"""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), MONGO_PING_TIMEOUT)
+        mongo = {"status": "ok", "ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except (PyMongoError, asyncio.TimeoutError) as exc:
+        mongo = {"status": "unavailable", "error": str(exc) or type(exc).__name__}
+    body = {
+        "status": mongo["status"],
+        "mongo": mongo,
+        "pool": {
+            **pool_monitor.stats(),
+            "max_size": MONGO_CLIENT_OPTIONS["maxPoolSize"],
+            "min_size": MONGO_CLIENT_OPTIONS["minPoolSize"],
+        },
+        "commands": database_timer.stats(),
+        "read_preference": MONGO_READ_PREFERENCE,
+    }
+    return FastJSONResponse(body, status_code=200 if mongo["status"] == "ok" else 503, headers={"Cache-Control": "no-store"})
+
+# Metrics
+@api_router.get("/metrics")
+async def get_metrics():
+    return {
+        "exports": export_coalescer.stats(),
+        "admission": export_admission.stats(),
+        "memory": render_memory.stats(),
+        "text_shaping": shape_pdf_text.cache_info()._asdict(),
+        "thumbnails": thumbnail_cache.stats(),
+        "idempotency_artifacts": idempotency_artifacts.stats(),
+        "company_cache": company_cache.stats(),
+        "compression": dict(compression_stats),
+        "catalog_cache": catalog_cache.stats(),
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_LOGO_SIZE + MULTIPART_OVERHEAD,
+    paths=["/api/company/logo"],
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1098,13 +4273,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if PROFILING_ENABLED:
+    # Added after CORS so the measured latency covers the whole request
+    app.add_middleware(ProfilingMiddleware)
+
+app.add_middleware(CompressionMiddleware)
+
+# Added last so it is outermost: the request id is set before anything logs,
+# and the access line covers every other middleware
+app.add_middleware(RequestContextMiddleware)
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# Startup and shutdown steps, run by lifespan()
+async def create_indexes():
+    await db.quote_revisions.create_index([("quote_id", 1), ("version", 1)], unique=True)
+    await db.companies.create_index("tenant_id", unique=True)
+    # Quote reads are always tenant-scoped, so their indexes lead with the tenant
+    await db.quotes.create_index([("tenant_id", 1), ("created_date", -1)])
+    # Merged exports filter by customer within a period
+    await db.quotes.create_index([("tenant_id", 1), ("customer.name", 1), ("created_date", 1)])
+    await db.quotes.create_index([("tenant_id", 1), ("customer.tax_number", 1), ("created_date", 1)])
+    # Covers the id lookup and the updated_date/version read behind conditional GETs
+    await db.quotes.create_index([("tenant_id", 1), ("id", 1), ("updated_date", 1), ("version", 1)])
+    # Used by the quote event poller when change streams are unavailable, and by archival
+    await db.quotes.create_index([("updated_date", 1)])
+    await db.archived_quotes.create_index([("tenant_id", 1), ("id", 1)], unique=True)
+    await db.archived_quotes.create_index([("tenant_id", 1), ("created_date", 1)])
+    await db.catalog_items.create_index([("tenant_id", 1), ("id", 1)], unique=True)
+    # Multikey: anchored prefix regexes on search_keys become index range scans
+    await db.catalog_items.create_index([("tenant_id", 1), ("search_keys", 1)])
+    # Searches come back in description order: this one serves the listing and
+    # broad prefixes without an in-memory sort, the one above narrow prefixes
+    await db.catalog_items.create_index([("tenant_id", 1), ("description", 1), ("search_keys", 1)])
+    await db.idempotency_keys.create_index([("scope", 1), ("key", 1)], unique=True)
+    await db.idempotency_keys.create_index("created_date", expireAfterSeconds=IDEMPOTENCY_TTL)
+    if RATE_LIMIT_BACKEND == "mongo" and export_admission.buckets is not None:
+        # Buckets idle long enough to refill completely can be dropped
+        await db.rate_limits.create_index("expires", expireAfterSeconds=int(EXPORT_RATE_BURST / EXPORT_RATE_PER_SECOND) + 60)
+
+def start_background_jobs():
+    quote_events.start()
+    # Keep a reference so the background migration is not garbage collected
+    app.state.date_migration = asyncio.create_task(run_date_migration())
+    if ARCHIVE_AFTER_DAYS > 0:
+        app.state.archival = asyncio.create_task(run_archival())
+
+async def stop_background_jobs():
+    await quote_events.stop()
+    if getattr(app.state, "archival", None):
+        app.state.archival.cancel()
+    # Renders already in the threadpool cannot be cancelled; let them finish before the client goes
+    await asyncio.gather(*background_tasks, return_exceptions=True)
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Settings are read when server is imported, so they go in first
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "quotes_test")
+os.environ.update(
+    ADMIN_TOKEN="test-admin-token",
+    ARCHIVE_AFTER_DAYS="0",
+    EXPORT_RATE_PER_SECOND="1000",
+    EXPORT_RATE_BURST="1000",
+    LOG_LEVEL="WARNING",
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+ADMIN_HEADERS = {"X-Admin-Token": "test-admin-token"}
+
+
+def quote_payload(items: int = 2, customer: str = "عميل", notes: str = "ملاحظة") -> dict:
+    return {
+        "customer": {"name": customer, "city": "جدة"},
+        "project_description": "مشروع مظلات",
+        "location": "جدة",
+        "items": [
+            {"description": f"بند {i}", "quantity": i + 1, "unit": "م2", "unit_price": 100.0, "total_price": 100.0 * (i + 1)}
+            for i in range(items)
+        ],
+        "subtotal": 300.0,
+        "tax_amount": 45.0,
+        "total_amount": 345.0,
+        "notes": notes,
+    }
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """The app against a fresh in-memory Mongo, started and stopped through its lifespan"""
+    monkeypatch.setattr(server, "idempotency_artifacts", server.FileCache(tmp_path / "idempotency", server.IDEMPOTENCY_ARTIFACT_BYTES))
+    mongo = AsyncMongoMockClient(tz_aware=True)
+    server.client = mongo
+    server.db = server.read_db = mongo["quotes_test"]
+    server.company_cache.entries.clear()
+    server.catalog_cache.entries.clear()
+    with TestClient(server.app) as test_client:
+        yield test_client
+    server.client = server.db = server.read_db = None
+
+
+@pytest.fixture
+def call_db(client):
+    """Runs a coroutine function on the app's event loop, for direct database access"""
+    def call(function, *args, **kwargs):
+        return client.portal.call(lambda: function(*args, **kwargs))
+    return call
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from .conftest import quote_payload
+
+
+def test_zero_rate_disables_rate_limiting(monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_RATE_PER_SECOND", 0)
+    admission = server.AdmissionController()
+
+    async def spend():
+        for _ in range(100):
+            await admission.check_rate("ip:1")
+    asyncio.run(spend())
+    assert admission.stats()["rejected"] == 0
+
+
+def test_empty_bucket_is_rejected_past_the_queue_timeout(monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_RATE_PER_SECOND", 0.01)
+    monkeypatch.setattr(server, "EXPORT_RATE_BURST", 2)
+    admission = server.AdmissionController()
+
+    async def spend():
+        for _ in range(2):
+            await admission.check_rate("ip:1")
+        with pytest.raises(HTTPException) as raised:
+            await admission.check_rate("ip:1")
+        assert raised.value.status_code == 429
+        # Other clients have buckets of their own
+        await admission.check_rate("ip:2")
+    asyncio.run(spend())
+
+
+@pytest.mark.parametrize("hops, forwarded_for, expected", [
+    (0, "1.1.1.1", "ip:testclient"),
+    (1, "6.6.6.6, 1.1.1.1", "ip:1.1.1.1"),
+    (2, "6.6.6.6, 1.1.1.1, 10.0.0.2", "ip:1.1.1.1"),
+    (3, "1.1.1.1", "ip:1.1.1.1"),
+])
+def test_client_key_counts_trusted_proxy_hops(client, monkeypatch, hops, forwarded_for, expected):
+    monkeypatch.setattr(server, "TRUST_FORWARDED_FOR", hops)
+    seen = []
+    monkeypatch.setattr(server.export_admission, "check_rate", lambda key: seen.append(key) or asyncio.sleep(0))
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    client.get(f"/api/quotes/{quote['id']}/export/excel", headers={"X-Forwarded-For": forwarded_for})
+    assert seen == [expected]
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+import server
+from .conftest import quote_payload
+
+
+def test_archived_quotes_stay_readable(client, call_db):
+    quote = client.post("/api/quotes", json=quote_payload(items=3)).json()
+    stored = client.get(f"/api/quotes/{quote['id']}").json()
+    assert call_db(server.archive_quotes, datetime.now(timezone.utc) + timedelta(days=1)) == 1
+    assert call_db(server.db.quotes.count_documents, {}) == 0
+
+    assert client.get(f"/api/quotes/{quote['id']}").json() == stored
+    assert client.get(f"/api/quotes/{quote['id']}/export/word").status_code == 200
+    assert client.get("/api/quotes/export/pdf").status_code == 200
+    # Numbering continues after archived quotes, even when the counter has to be seeded again
+    call_db(server.db.counters.delete_many, {})
+    assert client.post("/api/quotes", json=quote_payload()).json()["quote_number"] == "2"
+
+    # Editing moves the quote back to the hot collection
+    updated = client.put(f"/api/quotes/{quote['id']}", json={"notes": "back"})
+    assert updated.status_code == 200
+    assert updated.json()["items"] == stored["items"]
+    assert call_db(server.db.archived_quotes.count_documents, {}) == 0
+
+
+def test_archived_quote_can_be_deleted(client, call_db):
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    call_db(server.archive_quotes, datetime.now(timezone.utc) + timedelta(days=1))
+    assert client.delete(f"/api/quotes/{quote['id']}").status_code == 200
+    assert client.get(f"/api/quotes/{quote['id']}").status_code == 404
+
+
+def test_listing_merges_archived_quotes_by_created_date(client, call_db):
+    ids = [client.post("/api/quotes", json=quote_payload(customer=f"c{i}")).json()["id"] for i in range(4)]
+    items = client.get("/api/quotes").json()[0]["items"]
+    for days_ago, quote_id in zip((40, 30, 20, 10), ids):
+        created = datetime.now(timezone.utc) - timedelta(days=days_ago)
+        call_db(server.db.quotes.update_one, {"id": quote_id}, {"$set": {"created_date": created, "updated_date": created}})
+    # The two in the middle go to the archive
+    for quote_id in ids[1:3]:
+        stored = call_db(server.db.quotes.find_one, {"id": quote_id})
+        call_db(server.db.archived_quotes.insert_one, server.freeze_quote(stored))
+        call_db(server.db.quotes.delete_one, {"id": quote_id})
+
+    listed = client.get("/api/quotes").json()
+    assert [quote["id"] for quote in listed] == ids[::-1]
+    assert listed[1]["items"] == items
+    assert [quote["id"] for quote in client.get("/api/quotes?skip=1&limit=2").json()] == [ids[2], ids[1]]
+    since = (datetime.now(timezone.utc) - timedelta(days=25)).isoformat()
+    assert [quote["id"] for quote in client.get("/api/quotes", params={"from": since}).json()] == [ids[3], ids[2]]
@@ -0,0 +1,37 @@
+import server
+
+
+def test_catalog_search_keys_fold_case_diacritics_and_alef():
+    keys = server.catalog_search_keys({"description": "مِظَلّة  أرضية Large", "code": "AB-1"})
+    assert keys == ["مظلة ارضية large", "ارضية large", "large", "ab-1"]
+
+
+def test_catalog_search_key_normalizes_width_and_spacing():
+    assert server.catalog_search_key("  ＡＢＣ   إضاءة ") == "abc اضاءة"
+
+
+def test_catalog_search_keys_without_code_are_unique():
+    assert server.catalog_search_keys({"description": "مظلة مظلة"}) == ["مظلة مظلة", "مظلة"]
+
+
+def test_catalog_search_keys_are_capped():
+    description = " ".join(f"كلمة{i}" for i in range(200))
+    keys = server.catalog_search_keys({"description": description})
+    assert len(keys) == 200
+    assert max(map(len, keys)) <= server.CATALOG_SEARCH_KEY_LENGTH
+    assert sum(map(len, keys)) <= 200 * server.CATALOG_SEARCH_KEY_LENGTH
+
+
+def test_catalog_search_by_word_and_long_query(client):
+    long_description = "مظلة شد إنشائي بقماش بي في دي إف ألماني مقاوم للأشعة فوق البنفسجية"
+    for description, code in ((long_description, "UV-1"), ("مظلة سيارات", "CAR-2"), ("خيمة", None)):
+        client.post("/api/catalog", json={"description": description, "code": code, "unit": "م2", "unit_price": 10})
+
+    def search(q):
+        return [item["description"] for item in client.get("/api/catalog", params={"q": q}).json()]
+    assert search("مظلة") == sorted([long_description, "مظلة سيارات"])
+    assert search("سيار") == ["مظلة سيارات"]
+    assert search("car") == ["مظلة سيارات"]
+    # Queries longer than the keys match on their first CATALOG_SEARCH_KEY_LENGTH characters
+    assert search(long_description) == [long_description]
+    assert search("") == sorted([long_description, "مظلة سيارات", "خيمة"])
@@ -0,0 +1,55 @@
+import bson
+import pytest
+
+import server
+
+
+def make_items(count: int):
+    return [
+        {
+            "description": f"بند {i}",
+            "quantity": float(i % 7 + 1),
+            "unit": ("م2", "قطعة", "متر")[i % 3],
+            "unit_price": 12.5 * i,
+            "total_price": 12.5 * i * (i % 7 + 1),
+            "catalog_item_id": f"cat-{i}" if i % 2 else None,
+        }
+        for i in range(count)
+    ]
+
+
+def test_packed_items_round_trip_through_bson():
+    items = make_items(50)
+    packed = bson.decode(bson.encode({"p": server.pack_items(items)}))["p"]
+    view = server.PackedItems(packed)
+    assert len(view) == 50
+    assert view.dicts() == items
+    assert packed["units"] == ["م2", "قطعة", "متر"]
+
+
+def test_packed_items_sequence_access():
+    items = make_items(10)
+    view = server.PackedItems(server.pack_items(items))
+    assert view[3].description == "بند 3"
+    assert view[-1].unit_price == items[-1]["unit_price"]
+    assert [item.unit for item in view[2:5]] == [item["unit"] for item in items[2:5]]
+    assert [item.catalog_item_id for item in view] == [item["catalog_item_id"] for item in items]
+    with pytest.raises(IndexError):
+        view[10]
+
+
+def test_packed_items_omit_empty_catalog_column():
+    items = [dict(item, catalog_item_id=None) for item in make_items(3)]
+    packed = server.pack_items(items)
+    assert "catalog_item_id" not in packed
+    assert server.PackedItems(packed).dicts() == items
+
+
+def test_pack_large_items_threshold(monkeypatch):
+    monkeypatch.setattr(server, "COLUMNAR_ITEMS_THRESHOLD", 5)
+    small = {"items": make_items(4)}
+    assert server.pack_large_items(small) is small and "items_packed" not in small
+    large = {"items": make_items(5)}
+    server.pack_large_items(large)
+    assert "items" not in large
+    assert server.unpack_items(large)["items"] == make_items(5)
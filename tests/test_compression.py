@@ -0,0 +1,48 @@
+import zlib
+
+import pytest
+
+import server
+from .conftest import quote_payload
+
+
+def test_negotiate_encoding_prefers_server_order():
+    preferred = next(iter(server.RESPONSE_ENCODERS))
+    assert server.negotiate_encoding("gzip, deflate, br, zstd") == preferred
+    assert server.negotiate_encoding("*") == preferred
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip", "gzip"),
+    ("GZIP;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("*;q=0", None),
+    ("identity", None),
+    ("deflate", None),
+    ("", None),
+    ("gzip;q=bogus", None),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert server.negotiate_encoding(accept_encoding) == expected
+
+
+def test_encode_body_round_trip():
+    body = "عرض سعر ".encode() * 1000
+    assert zlib.decompress(server.encode_body("gzip", body), server.GZIP_WBITS) == body
+
+
+def test_compressed_quote_revalidates_with_its_weak_etag(client):
+    quote = client.post("/api/quotes", json=quote_payload(items=100)).json()
+    url = f"/api/quotes/{quote['id']}"
+    first = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert first.headers["content-encoding"] == "gzip"
+    weak = first.headers["etag"]
+    assert weak.startswith("W/")
+
+    cached = client.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": weak})
+    assert cached.status_code == 304
+    # The 304 names the representation the client holds
+    assert cached.headers["etag"] == weak
+    strong = client.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": weak.removeprefix("W/")})
+    assert strong.status_code == 304
+    assert strong.headers["etag"] == weak.removeprefix("W/")
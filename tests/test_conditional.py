@@ -0,0 +1,46 @@
+import server
+from .conftest import quote_payload
+
+
+def test_quote_get_revalidates_with_etag(client):
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    first = client.get(f"/api/quotes/{quote['id']}")
+    etag = first.headers["etag"]
+
+    cached = client.get(f"/api/quotes/{quote['id']}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    client.put(f"/api/quotes/{quote['id']}", json={"notes": "changed"})
+    changed = client.get(f"/api/quotes/{quote['id']}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["notes"] == "changed"
+
+
+def test_export_revalidates_and_depends_on_company(client):
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    url = f"/api/quotes/{quote['id']}/export/excel"
+    first = client.get(url)
+    assert first.status_code == 200
+    assert client.get(url, headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    company = client.get("/api/company").json()
+    client.put("/api/company", json={**company, "name_en": "Renamed Co."})
+    assert client.get(url, headers={"If-None-Match": first.headers["etag"]}).status_code == 200
+
+
+def test_export_etags_change_with_the_renderer(client, monkeypatch):
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    url = f"/api/quotes/{quote['id']}/export/pdf"
+    etag = client.get(url).headers["etag"]
+    thumbnail = server.thumbnail_variant(240, "webp", "c1")
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    monkeypatch.setattr(server, "EXPORT_TEMPLATE_VERSION", server.EXPORT_TEMPLATE_VERSION + 1)
+    monkeypatch.setattr(server, "RENDERER_VERSION", server.renderer_version())
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert server.thumbnail_variant(240, "webp", "c1") != thumbnail
@@ -0,0 +1,10 @@
+from .conftest import quote_payload
+
+
+def test_every_route_emits_utc_dates(client):
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    updated = client.put(f"/api/quotes/{quote['id']}", json={"notes": "x"}).json()
+    listed = client.get("/api/quotes").json()[0]
+    revision = client.get(f"/api/quotes/{quote['id']}/revisions").json()[0]
+    for value in (quote["created_date"], updated["updated_date"], listed["updated_date"], revision["created_date"]):
+        assert value.endswith("Z")
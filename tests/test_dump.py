@@ -0,0 +1,83 @@
+import gzip
+import json
+
+import pytest
+
+import server
+from .conftest import ADMIN_HEADERS, quote_payload
+
+TRICKY_NOTES = 'سطر أول\nsecond line, with "quotes"\r\nوسطر ثالث'
+
+
+def seed(client, monkeypatch):
+    # A low threshold so one quote is stored with columnar items
+    monkeypatch.setattr(server, "COLUMNAR_ITEMS_THRESHOLD", 20)
+    client.put("/api/company", json={**client.get("/api/company").json(), "name_en": "Main Co."})
+    client.put("/api/company", json={**client.get("/api/company").json(), "name_en": "Acme Co."}, headers={"X-Tenant-ID": "acme"})
+    client.post("/api/quotes", json=quote_payload(2, notes=TRICKY_NOTES))
+    client.post("/api/quotes", json=quote_payload(25))
+    client.post("/api/quotes", json=quote_payload(1, customer="Acme"), headers={"X-Tenant-ID": "acme"})
+
+
+def snapshot(client):
+    return {
+        tenant: (client.get("/api/company", headers=headers).json(), client.get("/api/quotes", headers=headers).json())
+        for tenant, headers in (("default", {}), ("acme", {"X-Tenant-ID": "acme"}))
+    }
+
+
+def wipe(call_db):
+    for collection in ("companies", "quotes", "quote_revisions", "counters"):
+        call_db(server.db[collection].delete_many, {})
+    server.company_cache.entries.clear()
+
+
+def test_ndjson_dump_restores_everything(client, call_db, monkeypatch):
+    seed(client, monkeypatch)
+    before = snapshot(client)
+    dump = client.get("/api/admin/dump", headers=ADMIN_HEADERS)
+    assert dump.status_code == 200
+    records = [json.loads(line) for line in gzip.decompress(dump.content).splitlines()]
+    assert len(records) == 5
+
+    wipe(call_db)
+    restored = client.post("/api/admin/restore", content=dump.content, headers=ADMIN_HEADERS)
+    assert restored.json() == {"companies": 2, "quotes": 3, "skipped": 0}
+    assert snapshot(client) == before
+    # Restored quotes keep their history and numbering
+    quote = before["default"][1][0]
+    assert client.get(f"/api/quotes/{quote['id']}/revisions/1").status_code == 200
+    assert client.post("/api/quotes", json=quote_payload()).json()["quote_number"] == "3"
+
+    again = client.post("/api/admin/restore", content=dump.content, headers=ADMIN_HEADERS)
+    assert again.json()["skipped"] == 3
+
+
+def test_csv_dump_round_trips_quotes(client, call_db, monkeypatch):
+    seed(client, monkeypatch)
+    before = snapshot(client)
+    dump = client.get("/api/admin/dump?format=csv&collection=quotes", headers=ADMIN_HEADERS)
+    assert dump.status_code == 200
+
+    call_db(server.db.quotes.delete_many, {})
+    restored = client.post("/api/admin/restore?format=csv&collection=quotes", content=dump.content, headers=ADMIN_HEADERS)
+    assert restored.json() == {"companies": 0, "quotes": 3, "skipped": 0}
+    assert snapshot(client) == before
+
+
+def test_tenant_dump_contains_only_that_tenant(client, monkeypatch):
+    seed(client, monkeypatch)
+    dump = client.get("/api/admin/dump?tenant=acme", headers=ADMIN_HEADERS)
+    records = [json.loads(line) for line in gzip.decompress(dump.content).splitlines()]
+    assert len(records) == 2
+    assert {record["document"]["tenant_id"] for record in records} == {"acme"}
+
+
+@pytest.mark.parametrize("body", [b"not gzip at all", gzip.compress(b'{"collection": "quotes", "document": ')[:-4]])
+def test_restore_rejects_damaged_files(client, body):
+    assert client.post("/api/admin/restore", content=body, headers=ADMIN_HEADERS).status_code == 400
+
+
+def test_dump_requires_the_admin_token(client):
+    assert client.get("/api/admin/dump").status_code == 403
+    assert client.get("/api/admin/dump", headers={"X-Admin-Token": "wrong"}).status_code == 403
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def idle_broker(monkeypatch) -> server.QuoteEventBroker:
+    """A broker whose watcher waits forever instead of reading Mongo"""
+    broker = server.QuoteEventBroker()
+    monkeypatch.setattr(broker, "_run", lambda: asyncio.sleep(3600))
+    monkeypatch.setattr(server, "quote_events", broker)
+    return broker
+
+
+def test_stop_ends_open_streams(monkeypatch):
+    broker = idle_broker(monkeypatch)
+
+    async def run():
+        stream = server.quote_event_stream("default", None)
+        assert (await anext(stream)).startswith("retry:")
+        pending = asyncio.ensure_future(anext(stream, None))
+        await asyncio.sleep(0)
+        await broker.stop()
+        assert await asyncio.wait_for(pending, 1) is None
+        assert broker.subscribers == {}
+        # Streams opened while shutting down end at once
+        assert [chunk async for chunk in server.quote_event_stream("default", None)] == ["retry: 3000\n\n"]
+    asyncio.run(run())
+
+
+def test_watcher_stops_with_the_last_subscriber(monkeypatch):
+    broker = idle_broker(monkeypatch)
+
+    async def run():
+        first = broker.subscribe("default")
+        second = broker.subscribe("acme")
+        task = broker._task
+        broker.unsubscribe(first)
+        assert not task.cancelled() and broker._task is task
+        broker.unsubscribe(second)
+        await asyncio.sleep(0)
+        assert task.cancelled() and broker._task is None
+        broker.subscribe("default")
+        assert broker._task is not None and broker._task is not task
+        await broker.stop()
+    asyncio.run(run())
+
+
+def test_polling_sees_writes_in_the_millisecond_already_read(client, monkeypatch):
+    monkeypatch.setattr(server, "QUOTE_EVENTS_POLL_INTERVAL", 0.01)
+    broker = server.QuoteEventBroker()
+    published = []
+    monkeypatch.setattr(broker, "publish", lambda token, event: published.append(event["id"]))
+    moment = (datetime.now(timezone.utc) + timedelta(seconds=5)).replace(microsecond=0)
+
+    async def run():
+        poller = asyncio.ensure_future(broker._poll())
+        await server.db.quotes.insert_one({"id": "a", "tenant_id": "default", "version": 1, "updated_date": moment})
+        await asyncio.sleep(0.05)
+        # Same millisecond as the last one read
+        await server.db.quotes.insert_one({"id": "b", "tenant_id": "default", "version": 1, "updated_date": moment})
+        await asyncio.sleep(0.05)
+        await server.db.quotes.update_one({"id": "a"}, {"$set": {"version": 2, "updated_date": moment}})
+        await asyncio.sleep(0.05)
+        poller.cancel()
+    client.portal.call(run)
+    assert published == ["a", "b", "a"]
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_health_reports_pool_and_latency(client):
+    health = client.get("/api/health")
+    assert health.status_code == 200
+    assert health.json()["status"] == "ok"
+    assert {"open", "in_use", "waiting", "max_size"} <= set(health.json()["pool"])
+
+
+def test_failed_startup_still_closes_the_client(monkeypatch):
+    class Unreachable:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+        async def command(self, name):
+            raise server.PyMongoError("no servers")
+
+    mongo = Unreachable()
+    monkeypatch.setattr(server, "client", mongo)
+    monkeypatch.setattr(server, "db", mongo)
+    monkeypatch.setattr(server, "MONGO_STARTUP_RETRIES", 1)
+
+    async def start():
+        async with server.lifespan(server.app):
+            pass
+    with pytest.raises(server.PyMongoError):
+        asyncio.run(start())
+    assert mongo.closed
@@ -0,0 +1,77 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+import server
+from .conftest import quote_payload
+
+
+def test_idempotent_create_replays_the_first_response(client):
+    headers = {"Idempotency-Key": "create-1"}
+    first = client.post("/api/quotes", json=quote_payload(), headers=headers)
+    retry = client.post("/api/quotes", json=quote_payload(), headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert len(client.get("/api/quotes").json()) == 1
+
+    reused = client.post("/api/quotes", json=quote_payload(items=3), headers=headers)
+    assert reused.status_code == 422
+
+
+def test_idempotency_key_with_expired_lease_is_taken_over(client, call_db):
+    body = json.dumps(quote_payload()).encode()
+    an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+    # Left behind by a worker that died mid-request
+    call_db(server.db.idempotency_keys.insert_one, {
+        "scope": f"create_quote:{server.DEFAULT_TENANT_ID}",
+        "key": "orphaned",
+        "request_hash": hashlib.sha256(b"/api/quotes?\n" + body).hexdigest(),
+        "status": "in_progress",
+        "created_date": an_hour_ago,
+        "lease_until": an_hour_ago,
+    })
+    headers = {"Idempotency-Key": "orphaned", "Content-Type": "application/json"}
+    taken_over = client.post("/api/quotes", content=body, headers=headers)
+    assert taken_over.status_code == 200
+    assert "idempotent-replayed" not in taken_over.headers
+    replayed = client.post("/api/quotes", content=body, headers=headers)
+    assert replayed.headers["idempotent-replayed"] == "true"
+    assert replayed.json()["id"] == taken_over.json()["id"]
+
+
+def test_large_export_is_replayed_from_a_file(client, call_db, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_INLINE_BODY", 1024)
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    url = f"/api/quotes/{quote['id']}/export/pdf"
+    headers = {"Idempotency-Key": "export-1"}
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    record = call_db(server.db.idempotency_keys.find_one, {"key": "export-1"})
+    # The record references the body instead of holding it
+    assert "body" not in record["response"]
+    assert record["response"]["size"] == len(first.content)
+
+    replayed = client.get(url, headers=headers)
+    assert replayed.headers["idempotent-replayed"] == "true"
+    assert replayed.content == first.content
+    assert replayed.headers["content-length"] == str(len(first.content))
+
+    # Once the file is evicted the retry renders again
+    (server.idempotency_artifacts.directory / record["response"]["artifact"]).unlink()
+    rendered = client.get(url, headers=headers)
+    assert "idempotent-replayed" not in rendered.headers
+    assert rendered.content == first.content
+    assert client.get(url, headers=headers).headers["idempotent-replayed"] == "true"
+
+
+def test_merged_export_is_idempotent(client):
+    for customer in ("Acme", "Acme"):
+        client.post("/api/quotes", json=quote_payload(customer=customer))
+    headers = {"Idempotency-Key": "merged-1"}
+    first = client.get("/api/quotes/export/pdf?customer=Acme", headers=headers)
+    assert first.status_code == 200
+    replayed = client.get("/api/quotes/export/pdf?customer=Acme", headers=headers)
+    assert replayed.headers["idempotent-replayed"] == "true"
+    assert replayed.content == first.content
+    assert client.get("/api/quotes/export/pdf?customer=Other", headers=headers).status_code == 422
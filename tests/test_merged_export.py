@@ -0,0 +1,30 @@
+import pytest
+
+import server
+from .conftest import quote_payload
+
+pdfium = pytest.importorskip("pypdfium2")
+
+
+def test_merged_pdf_streams_from_a_spooled_file(client, monkeypatch):
+    monkeypatch.setattr(server, "MERGED_EXPORT_SPOOL_SIZE", 1024)
+    for i in range(3):
+        client.post("/api/quotes", json=quote_payload(items=i + 1, customer="Acme"))
+    response = client.get("/api/quotes/export/pdf?customer=Acme")
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(response.content))
+    document = pdfium.PdfDocument(response.content)
+    try:
+        assert len(list(document.get_toc())) == 3
+    finally:
+        document.close()
+
+
+def test_merged_pdf_rejects_batches_over_the_limit(client, monkeypatch):
+    monkeypatch.setattr(server, "MERGED_EXPORT_MAX_QUOTES", 2)
+    for _ in range(3):
+        client.post("/api/quotes", json=quote_payload())
+    response = client.get("/api/quotes/export/pdf")
+    assert response.status_code == 400
+    assert "at most 2" in response.json()["detail"]
+    assert client.get("/api/quotes/export/pdf?customer=nobody").status_code == 404
@@ -0,0 +1,77 @@
+import copy
+
+import pytest
+
+import server
+from .conftest import quote_payload
+
+
+@pytest.mark.parametrize("old, new", [
+    ({"a": 1, "b": "x"}, {"a": 2, "b": "x"}),
+    ({"a": 1, "b": "x"}, {"a": 1}),
+    ({"a": 1}, {"a": 1, "c": {"d": [1, 2]}}),
+    ({"a": {"b": {"c": 1, "d": 2}}}, {"a": {"b": {"c": 1, "e": 3}}}),
+    ({"items": [1, 2, 3]}, {"items": [1, 5]}),
+    ({"items": [1]}, {"items": [1, 2, 3]}),
+    ({"items": [{"q": 1, "u": "m"}, {"q": 2, "u": "m"}]}, {"items": [{"q": 1, "u": "x"}]}),
+    ({"a": 1}, {"a": 1.0}),
+    ({"a": None}, {"a": "value"}),
+    ({"a": [1, 2]}, {"a": {"0": 1}}),
+])
+def test_diff_round_trip(old, new):
+    diff = server.diff_documents(old, new)
+    assert server.apply_diff(copy.deepcopy(old), diff) == new
+    assert server.apply_diff(copy.deepcopy(new), server.diff_documents(new, old)) == old
+
+
+def test_diff_records_only_changed_leaves():
+    old = {"customer": {"name": "A", "city": "جدة"}, "items": [{"q": 1}, {"q": 2}], "notes": "n"}
+    new = {"customer": {"name": "B", "city": "جدة"}, "items": [{"q": 1}, {"q": 3}]}
+    diff = server.diff_documents(old, new)
+    assert diff == {"set": [["customer.name", "B"], ["items.1.q", 3]], "unset": ["notes"], "len": []}
+    assert server.changed_fields(diff) == ["customer", "items", "notes"]
+
+
+def test_apply_diff_does_not_share_values_with_the_diff():
+    diff = server.diff_documents({"a": 1}, {"a": 1, "b": {"c": [1]}})
+    doc = server.apply_diff({"a": 1}, diff)
+    doc["b"]["c"].append(2)
+    assert diff["set"] == [["b", {"c": [1]}]]
+
+
+@pytest.mark.parametrize("interval, kinds", [
+    (1, ["snapshot"] * 6),
+    (3, ["diff", "diff", "snapshot", "diff", "diff", "snapshot"]),
+])
+def test_every_revision_can_be_rebuilt(client, monkeypatch, interval, kinds):
+    monkeypatch.setattr(server, "QUOTE_SNAPSHOT_INTERVAL", interval)
+    quote = client.post("/api/quotes", json=quote_payload(3)).json()
+    # As stored: Mongo keeps dates to the millisecond
+    states = {1: client.get(f"/api/quotes/{quote['id']}").json()}
+    changes = [
+        {"notes": "first"},
+        {"items": quote_payload(5)["items"]},
+        {"customer": {"name": "عميل آخر", "city": "الرياض"}},
+        {"items": quote_payload(1)["items"], "notes": None},
+        {"location": "مكة"},
+    ]
+    for change in changes:
+        updated = client.put(f"/api/quotes/{quote['id']}", json=change)
+        assert updated.status_code == 200
+        states[updated.json()["version"]] = updated.json()
+
+    revisions = client.get(f"/api/quotes/{quote['id']}/revisions").json()
+    assert [revision["version"] for revision in revisions] == [6, 5, 4, 3, 2, 1]
+    assert [revision["kind"] for revision in revisions] == kinds
+    for version, state in states.items():
+        rebuilt = client.get(f"/api/quotes/{quote['id']}/revisions/{version}").json()
+        assert rebuilt == state
+    # A middle version comes from the snapshot at or before it plus the diffs in between
+    middle = client.get(f"/api/quotes/{quote['id']}/revisions/3").json()
+    assert (middle["notes"], len(middle["items"]), middle["customer"]["name"]) == ("first", 5, "عميل")
+
+
+def test_missing_revision_is_404(client):
+    quote = client.post("/api/quotes", json=quote_payload()).json()
+    assert client.get(f"/api/quotes/{quote['id']}/revisions/2").status_code == 404
+    assert client.get("/api/quotes/unknown/revisions/1").status_code == 404
@@ -0,0 +1,25 @@
+from .conftest import quote_payload
+
+
+def test_tenants_are_isolated(client):
+    acme = {"X-Tenant-ID": "acme"}
+    beta = {"X-Tenant-ID": "beta"}
+    acme_quote = client.post("/api/quotes", json=quote_payload(customer="Acme"), headers=acme).json()
+    beta_quote = client.post("/api/quotes", json=quote_payload(customer="Beta"), headers=beta).json()
+    # Each tenant numbers its own quotes
+    assert acme_quote["quote_number"] == beta_quote["quote_number"] == "1"
+
+    assert [quote["id"] for quote in client.get("/api/quotes", headers=acme).json()] == [acme_quote["id"]]
+    assert client.get("/api/quotes").json() == []
+    for method, suffix in (("get", ""), ("put", ""), ("delete", ""), ("get", "/export/pdf"), ("get", "/revisions")):
+        kwargs = {"json": {"notes": "x"}} if method == "put" else {}
+        response = client.request(method.upper(), f"/api/quotes/{acme_quote['id']}{suffix}", headers=beta, **kwargs)
+        assert response.status_code == 404, (method, suffix)
+
+    client.put("/api/company", json={**client.get("/api/company").json(), "name_en": "Acme Ltd"}, headers=acme)
+    assert client.get("/api/company", headers=acme).json()["name_en"] == "Acme Ltd"
+    assert client.get("/api/company", headers=beta).json()["name_en"] != "Acme Ltd"
+
+
+def test_invalid_tenant_header_is_rejected(client):
+    assert client.get("/api/quotes", headers={"X-Tenant-ID": "../etc"}).status_code == 400
@@ -0,0 +1,42 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.mark.parametrize("header, size, expected", [
+    ("bytes=0-9", 100, (0, 9)),
+    ("bytes=90-", 100, (90, 99)),
+    ("bytes=-10", 100, (90, 99)),
+    ("bytes=-500", 100, (0, 99)),
+    ("bytes=95-200", 100, (95, 99)),
+    ("items=0-9", 100, None),
+    ("bytes=0-1,5-6", 100, None),
+    ("bytes=9-2", 100, None),
+    ("bytes=abc", 100, None),
+    ("bytes=-0", 100, None),
+])
+def test_parse_byte_range(header, size, expected):
+    assert server.parse_byte_range(header, size) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=100-", 100), ("bytes=0-", 0)])
+def test_parse_byte_range_unsatisfiable(header, size):
+    with pytest.raises(HTTPException) as raised:
+        server.parse_byte_range(header, size)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("head, extension", [
+    (b"\x89PNG\r\n\x1a\n" + b"\0" * 8, ".png"),
+    (b"\xff\xd8\xff\xe0\0\x10JFIF", ".jpg"),
+    (b"GIF89a\x01\0", ".gif"),
+    (b"GIF87a\x01\0", ".gif"),
+    (b"RIFF\x24\0\0\0WEBPVP8 ", ".webp"),
+    (b"RIFF\x24\0\0\0WAVEfmt ", None),
+    (b"<svg xmlns=", None),
+    (b"", None),
+])
+def test_sniff_image_extension(head, extension):
+    assert server.sniff_image_extension(head) == extension